@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# grokbot.config creates its log directory on import; keep benchmark runs out of /app
+if "LOG_DIR" not in os.environ:
+    os.environ["LOG_DIR"] = tempfile.mkdtemp(prefix="grokbot-bench-")
@@ -0,0 +1,125 @@
+"""Compare the old and new payload serialization paths on a realistic tool loop.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_serialization [--iterations 5] [--repeat 200]
+
+The "old" path hashes json.dumps(payload, sort_keys=True) for the cache key,
+serializes the payload again for the request body and parses the response
+with the stdlib json module, rebuilding everything on each tool iteration.
+The "new" path uses PayloadEncoder from grokbot.serialization.
+"""
+import argparse
+import hashlib
+import json
+import random
+import string
+import time
+from grokbot.serialization import PayloadEncoder, dumps, loads, orjson
+
+TOOL_DEFINITIONS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "web_search",
+            "description": "Perform a web search to get current information",
+            "parameters": {
+                "type": "object",
+                "properties": {"query": {"type": "string", "description": "The search query"}},
+                "required": ["query"]
+            }
+        }
+    }
+]
+
+def words(rng, n):
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(n))
+
+def build_conversation(rng, iterations):
+    """Initial messages plus, per tool iteration, the assistant tool call and its search result."""
+    history = "\n".join(f"user{i}: {words(rng, 40)}" for i in range(5))
+    initial = [
+        {"role": "system", "content": "Today's date and time is 10:00 AM +00 on Monday, January 01, 2024."},
+        {"role": "user", "content": f"Conversation history:\n{history}\nCurrent question from someone: {words(rng, 30)}"}
+    ]
+    steps = []
+    for i in range(iterations):
+        call = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": f"call_{i}",
+                "type": "function",
+                "function": {"name": "web_search", "arguments": json.dumps({"query": words(rng, 5)})}
+            }]
+        }
+        results = "\n\n".join(f"{j}. {words(rng, 8)}\n   {words(rng, 60)}" for j in range(1, 11))
+        steps.append([call, {"role": "tool", "content": results, "tool_call_id": f"call_{i}"}])
+    return initial, steps
+
+def build_response(rng):
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": words(rng, 400)}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 3000, "completion_tokens": 600, "total_tokens": 3600}
+    }
+
+def old_path(params, initial, steps, response_bytes):
+    messages = list(initial)
+    total = 0
+    for step in [[]] + steps:
+        messages.extend(step)
+        payload = dict(params, messages=messages)
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        body = json.dumps(payload).encode()
+        data = json.loads(response_bytes)
+        total += len(body) + len(key) + len(data)
+    return total
+
+def new_path(params, initial, steps, response_bytes):
+    payload = PayloadEncoder(params, initial)
+    total = 0
+    for step in [[]] + steps:
+        for message in step:
+            payload.append(message)
+        key = payload.cache_key()
+        body = payload.body()
+        data = loads(response_bytes)
+        total += len(body) + len(key) + len(data)
+    return total
+
+def measure(fn, args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5, help="tool iterations per request")
+    parser.add_argument("--repeat", type=int, default=200, help="timed runs per path")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    params = {"model": "grok-3-mini", "tools": TOOL_DEFINITIONS, "tool_choice": "auto", "stream": False, "max_tokens": 5000}
+    initial, steps = build_conversation(rng, args.iterations)
+    response_bytes = json.dumps(build_response(rng)).encode()
+    final_size = len(dumps(dict(params, messages=initial + [m for step in steps for m in step])))
+
+    print(f"JSON backend: {'orjson ' + orjson.__version__ if orjson is not None else 'stdlib json'}")
+    print(f"Tool iterations: {args.iterations}, final payload: {final_size / 1024:.1f} KiB, response: {len(response_bytes) / 1024:.1f} KiB")
+    results = {}
+    for name, fn in (("old", old_path), ("new", new_path)):
+        fn(params, initial, steps, response_bytes)  # warm up
+        results[name] = measure(fn, (params, initial, steps, response_bytes), args.repeat)
+        p50, p95 = results[name]
+        print(f"{name:>4}: p50 {p50 * 1000:8.3f} ms   p95 {p95 * 1000:8.3f} ms   per request")
+    print(f"speedup (p50): {results['old'][0] / results['new'][0]:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Local stand-in for the chat-completions and speech endpoints.
+
+Serves /v1/chat/completions and /v1/audio/speech with configurable latency,
+tool calls, streaming and injected 429s, so the bot can be load tested
+without network access. Run standalone with:
+
+    python -m benchmarks.fake_provider --port 8900 --latency 0.8
+
+Chat completions are streamed as server-sent events when the request asks for
+"stream": true, or for every request with --stream. The bot requests plain JSON
+completions, so --stream is only offered by the standalone server; speech is
+always streamed in chunks paced by --token-interval.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from aiohttp import web
+
+class FakeProviderConfig:
+    def __init__(self, latency=0.5, jitter=0.2, tool_share=0.3, max_tool_calls=2, rate_429=0.0,
+                 answer_chars=600, token_interval=0.01, audio_bytes=48000, stream=False, seed=1234):
+        self.latency = latency  # mean seconds before the first byte
+        self.jitter = jitter  # standard deviation of the latency
+        self.tool_share = tool_share  # share of conversations that call web_search at least once
+        self.max_tool_calls = max_tool_calls  # tool iterations for such a conversation are 1..max
+        self.rate_429 = rate_429  # share of requests answered with HTTP 429
+        self.answer_chars = answer_chars
+        self.token_interval = token_interval  # delay between streamed chunks
+        self.audio_bytes = audio_bytes
+        self.stream = stream  # answer every chat request with server-sent events
+        self.seed = seed
+
+class FakeProvider:
+    def __init__(self, config=None):
+        self.config = config or FakeProviderConfig()
+        self.rng = random.Random(self.config.seed)
+        self.runner = None
+        self.base_url = None
+        self.requests = 0
+        self.rejected = 0
+
+    @property
+    def chat_url(self):
+        return f"{self.base_url}/v1/chat/completions"
+
+    @property
+    def speech_url(self):
+        return f"{self.base_url}/v1/audio/speech"
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.handle_chat)
+        app.router.add_post("/v1/audio/speech", self.handle_speech)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def latency_for(self, request_body):
+        """Seconds to wait before answering; subclasses can override for replay."""
+        return max(0.0, self.rng.gauss(self.config.latency, self.config.jitter))
+
+    def tool_calls_for(self, messages):
+        """How many web_search iterations this conversation should go through."""
+        first_user = next((m for m in messages if m.get("role") == "user"), {})
+        digest = hashlib.sha256(json.dumps(first_user.get("content"), sort_keys=True).encode()).digest()
+        rng = random.Random(int.from_bytes(digest[:8], "big") ^ self.config.seed)
+        if rng.random() >= self.config.tool_share:
+            return 0
+        return rng.randint(1, max(1, self.config.max_tool_calls))
+
+    def answer_chars_for(self, messages):
+        return self.config.answer_chars
+
+    def tool_query_for(self, messages, iteration):
+        return f"query {iteration}"
+
+    def maybe_reject(self):
+        if self.config.rate_429 and self.rng.random() < self.config.rate_429:
+            self.rejected += 1
+            return web.json_response({"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                                     status=429, headers={"Retry-After": "1"})
+        return None
+
+    async def handle_chat(self, request):
+        self.requests += 1
+        body = await request.json()
+        rejection = self.maybe_reject()
+        if rejection is not None:
+            return rejection
+        await asyncio.sleep(self.latency_for(body))
+        messages = body.get("messages", [])
+        tool_results = sum(1 for m in messages if m.get("role") == "tool")
+        prompt_chars = sum(len(json.dumps(m.get("content"))) for m in messages)
+        if body.get("tools") and tool_results < self.tool_calls_for(messages):
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{self.requests}",
+                    "type": "function",
+                    "function": {"name": "web_search", "arguments": json.dumps({"query": self.tool_query_for(messages, tool_results)})}
+                }]
+            }
+            completion_chars = 60
+        else:
+            content = ("lorem ipsum dolor sit amet. " * (self.answer_chars_for(messages) // 28 + 1))[:self.answer_chars_for(messages)]
+            message = {"role": "assistant", "content": content}
+            completion_chars = len(content)
+        usage = {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": completion_chars // 4,
+            "total_tokens": (prompt_chars + completion_chars) // 4
+        }
+        if body.get("stream") or self.config.stream:
+            return await self.stream_chat(request, message, usage)
+        return web.json_response({
+            "id": f"chatcmpl-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if "tool_calls" in message else "stop"}],
+            "usage": usage
+        })
+
+    async def stream_chat(self, request, message, usage):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        content = message.get("content") or ""
+        for i in range(0, len(content), 20):
+            chunk = {"choices": [{"index": 0, "delta": {"content": content[i:i + 20]}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(self.config.token_interval)
+        if "tool_calls" in message:
+            chunk = {"choices": [{"index": 0, "delta": {"tool_calls": message["tool_calls"]}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def handle_speech(self, request):
+        self.requests += 1
+        body = await request.json()
+        rejection = self.maybe_reject()
+        if rejection is not None:
+            return rejection
+        await asyncio.sleep(self.latency_for(body))
+        response = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+        await response.prepare(request)
+        chunk = b"\xff" * 16384
+        remaining = self.config.audio_bytes
+        while remaining > 0:
+            await response.write(chunk[:remaining])
+            remaining -= len(chunk)
+            await asyncio.sleep(self.config.token_interval)
+        await response.write_eof()
+        return response
+
+def add_arguments(parser):
+    group = parser.add_argument_group("fake provider")
+    group.add_argument("--latency", type=float, default=0.5, help="mean upstream latency in seconds")
+    group.add_argument("--jitter", type=float, default=0.2, help="standard deviation of upstream latency")
+    group.add_argument("--tool-share", type=float, default=0.3, help="share of conversations that call web_search")
+    group.add_argument("--max-tool-calls", type=int, default=2, help="maximum web_search iterations per conversation")
+    group.add_argument("--rate-429", type=float, default=0.0, help="share of upstream requests rejected with HTTP 429")
+    group.add_argument("--answer-chars", type=int, default=600, help="length of final answers")
+    group.add_argument("--audio-bytes", type=int, default=48000, help="size of generated speech")
+    group.add_argument("--token-interval", type=float, default=0.01, help="delay in seconds between streamed chunks")
+
+def config_from_args(args):
+    return FakeProviderConfig(latency=args.latency, jitter=args.jitter, tool_share=args.tool_share,
+                              max_tool_calls=args.max_tool_calls, rate_429=args.rate_429,
+                              answer_chars=args.answer_chars, token_interval=args.token_interval,
+                              audio_bytes=args.audio_bytes, stream=getattr(args, "stream", False), seed=args.seed)
+
+async def serve(args):
+    provider = FakeProvider(config_from_args(args))
+    await provider.start(args.host, args.port)
+    print(f"Fake provider listening on {provider.base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await provider.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--stream", action="store_true", help="stream every chat completion as server-sent events")
+    add_arguments(parser)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
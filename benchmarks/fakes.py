@@ -0,0 +1,157 @@
+"""Minimal stand-ins for the discord.py objects the cogs touch.
+
+Only the attributes and coroutines used by MessageHandler and AICommands are
+implemented. Replies and follow-ups are recorded with timestamps so the
+harness can measure end-to-end latency.
+"""
+import asyncio
+import datetime
+import itertools
+import time
+from types import SimpleNamespace
+import discord
+from grokbot.providers import build_providers
+from grokbot.tts_cache import TTSCache
+from grokbot.usage import UsageTracker
+
+_ids = itertools.count(10 ** 17)
+
+def next_id():
+    return next(_ids)
+
+class FakeUser:
+    def __init__(self, name, user_id=None, bot=False):
+        self.id = user_id or next_id()
+        self.name = name
+        self.global_name = name
+        self.display_name = name
+        self.nick = None
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+        self.avatar = None
+        self.default_avatar = SimpleNamespace(url=f"https://cdn.example.invalid/avatars/{self.id}.png")
+        self.dms = []
+
+    async def send(self, content=None, **kwargs):
+        self.dms.append(content)
+
+class FakeAttachment:
+    def __init__(self, filename, content_type):
+        self.id = next_id()
+        self.filename = filename
+        self.content_type = content_type
+        self.url = f"https://cdn.example.invalid/attachments/{self.id}/{filename}"
+
+class FakeGuild:
+    def __init__(self, bot_user, guild_id=None):
+        self.id = guild_id or next_id()
+        self.members = {}
+        self.me = bot_user
+        self.add_member(bot_user)
+
+    def add_member(self, user):
+        self.members[user.id] = user
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakeChannel:
+    def __init__(self, guild, channel_id=None, fetch_latency=0.0):
+        self.id = channel_id or next_id()
+        self.guild = guild
+        self.fetch_latency = fetch_latency
+        self.messages = {}
+
+    def permissions_for(self, member):
+        return SimpleNamespace(send_messages=True)
+
+    def typing(self):
+        return _Typing()
+
+    async def fetch_message(self, message_id):
+        if self.fetch_latency:
+            await asyncio.sleep(self.fetch_latency)
+        try:
+            return self.messages[message_id]
+        except KeyError:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+
+class FakeMessage:
+    def __init__(self, channel, author, content, mentions=(), reference=None, attachments=(), message_id=None,
+                 send_latency=0.0):
+        self.id = message_id or next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+        self.reference = SimpleNamespace(message_id=reference.id) if reference is not None else None
+        self.attachments = list(attachments)
+        self.send_latency = send_latency
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.replies = []  # (time.monotonic(), content)
+        channel.messages[self.id] = self
+
+    async def reply(self, content=None, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.replies.append((time.monotonic(), content))
+        return FakeMessage(self.channel, self.guild.me, content or "")
+
+    async def add_reaction(self, emoji):
+        pass
+
+class FakeInteraction:
+    """Enough of discord.Interaction for commands that defer and answer through followup."""
+
+    def __init__(self, user, channel):
+        self.user = user
+        self.channel = channel
+        self.guild = channel.guild
+        self.sent = []  # (time.monotonic(), content, file)
+        self.response = SimpleNamespace(defer=self._defer, send_message=self._send)
+        self.followup = SimpleNamespace(send=self._send)
+
+    async def _defer(self, **kwargs):
+        pass
+
+    async def _send(self, content=None, file=None, **kwargs):
+        self.sent.append((time.monotonic(), content, file))
+
+class FakeBot:
+    """The attributes of GrokBot that the cogs read, pointed at local stand-ins."""
+
+    def __init__(self, chat_url, speech_url, tts_cache_dir, api_timeout=60, max_tokens=5000):
+        self.loop = asyncio.get_running_loop()
+        self.user = FakeUser("GrokBot", bot=True)
+        self.message_queue = asyncio.Queue()
+        self.user_api_selection = {}
+        self.react_user_id = None
+        self.trace_recorder = None
+        self.draining = False
+        self.user_pref_lock = asyncio.Lock()
+        self.user_pref_dirty = False
+        self.usage = UsageTracker(3600, 0, 0)
+        self.MAX_TOKENS = max_tokens
+        self.API_TIMEOUT = api_timeout
+        self.XAI_API_KEY = "xai-loadtest"
+        self.OPENAI_API_KEY = "openai-loadtest"
+        self.XAI_MODEL = "grok-3-mini"
+        self.OPENAI_MODEL = "gpt-4.1-mini"
+        self.XAI_CHAT_URL = chat_url
+        self.OPENAI_CHAT_URL = chat_url
+        self.OPENAI_VOICE_URL = speech_url
+        self.OPENAI_TTS_MODEL = "gpt-4o-mini-tts"
+        self.tts_cache = TTSCache(tts_cache_dir, 50 * 1024 * 1024)
+        self.providers = build_providers(self)
+
+    async def close(self):
+        for provider in self.providers.values():
+            await provider.close()
@@ -0,0 +1,293 @@
+"""End-to-end load test of the message pipeline against a local fake provider.
+
+Drives the real MessageHandler (and /aitts in AICommands) with synthetic
+mentions, reply chains and image attachments arriving as a Poisson process,
+answers them from benchmarks.fake_provider, and reports throughput, queue
+wait and end-to-end latency percentiles. Runs fully offline:
+
+    python -m benchmarks.loadtest --messages 300 --rate 10 --latency 0.8 --rate-429 0.05
+
+Use --json to save the results and --max-p95 / --min-throughput to fail the
+run (exit status 1) when a build regresses.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+from discord import app_commands
+from benchmarks.fake_provider import FakeProvider, add_arguments, config_from_args
+from benchmarks.fakes import FakeAttachment, FakeBot, FakeChannel, FakeGuild, FakeInteraction, FakeMessage, FakeUser
+from grokbot import api, config, metrics
+from grokbot.cogs.ai_commands import AICommands
+from grokbot.cogs.message_handler import MessageHandler
+from grokbot.tracing import TraceRecorder
+
+VOICES = ("alloy", "ash", "coral", "echo", "nova")
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank: the smallest value with at least q of the samples at or below it
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+class Workload:
+    """A stream of synthetic arrivals: (delay before arrival, kind, parameters)."""
+
+    def __init__(self, args, rng):
+        self.args = args
+        self.rng = rng
+
+    def __iter__(self):
+        args = self.args
+        for i in range(args.messages):
+            delay = self.rng.expovariate(args.rate) if args.rate > 0 else 0.0
+            if self.rng.random() < args.tts_share:
+                yield delay, "tts", {"text": f"synthetic voice line {i} " * self.rng.randint(1, 8)}
+                continue
+            depth = self.rng.randint(1, args.reply_depth) if self.rng.random() < args.reply_share else 0
+            yield delay, "mention", {
+                "question": f"question {i}: " + "what about this? " * self.rng.randint(1, 20),
+                "depth": depth,
+                "image": self.rng.random() < args.image_share,
+                "history_chars": self.rng.randint(20, 400),
+            }
+
+class LoadTest:
+    def __init__(self, args, workload=None):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.workload = workload if workload is not None else Workload(args, self.rng)
+        self.provider = None
+        self.bot = None
+        self.handler = None
+        self.commands = None
+        self.arrivals = {}  # message id -> arrival time
+        self.mentions = {}  # message id -> FakeMessage, whose replies carry send timestamps
+        self.started = {}
+        self.finished = {}  # when handle_message returned, including the pause after the last chunk
+        self.tts_latencies = []
+        self.pending = []
+
+    async def fake_search(self, query):
+        await asyncio.sleep(self.args.search_latency)
+        return "\n".join(f"{i}. Result {i} for {query}\n   " + "snippet text " * 20 for i in range(1, 11))
+
+    async def setup(self):
+        self.provider = self.make_provider()
+        await self.provider.start()
+        self.bot = FakeBot(self.provider.chat_url, self.provider.speech_url, os.path.join(os.environ["LOG_DIR"], "tts_cache"),
+                           api_timeout=self.args.api_timeout)
+        await self.bot.tts_cache.load()
+        api.tools_map["web_search"] = self.fake_search
+        api.api_cache.clear()
+        if self.args.record_trace:
+            self.bot.trace_recorder = TraceRecorder(self.args.record_trace, flush_interval=5)
+        self.handler = MessageHandler(self.bot)
+        self.commands = AICommands(self.bot)
+        handle_message = self.handler.handle_message
+
+        async def timed_handle_message(message):
+            self.started[message.id] = time.monotonic()
+            try:
+                await handle_message(message)
+            finally:
+                self.finished[message.id] = time.monotonic()
+        self.handler.handle_message = timed_handle_message
+
+        self.guild = FakeGuild(self.bot.user)
+        self.channels = [FakeChannel(self.guild, fetch_latency=self.args.fetch_latency) for _ in range(self.args.channels)]
+        self.users = [FakeUser(f"user{i}") for i in range(self.args.users)]
+        for user in self.users:
+            self.guild.add_member(user)
+            if self.rng.random() < self.args.xai_share:
+                self.bot.user_api_selection[user.id] = "xai"
+
+    def make_provider(self):
+        return FakeProvider(config_from_args(self.args))
+
+    def channel_for(self, params):
+        return self.rng.choice(self.channels)
+
+    def author_for(self, params):
+        return self.rng.choice(self.users)
+
+    def send_latency_for(self, params):
+        return self.args.send_latency
+
+    def build_mention(self, params):
+        channel = self.channel_for(params)
+        author = self.author_for(params)
+        reference = None
+        for depth in range(params["depth"]):
+            speaker = self.rng.choice(self.users)
+            reference = FakeMessage(channel, speaker, f"earlier message {depth} " + "x" * params["history_chars"], reference=reference)
+        attachments = [FakeAttachment("image.png", "image/png")] if params["image"] else []
+        return FakeMessage(channel, author, f"{self.bot.user.mention} {params['question']}", mentions=[self.bot.user],
+                           reference=reference, attachments=attachments, send_latency=self.send_latency_for(params))
+
+    async def run_tts(self, params):
+        interaction = FakeInteraction(self.rng.choice(self.users), self.rng.choice(self.channels))
+        voice = self.rng.choice(VOICES)
+        start = time.monotonic()
+        await self.commands.aitts.callback(self.commands, interaction, params["text"], app_commands.Choice(name=voice.title(), value=voice))
+        self.tts_latencies.append(time.monotonic() - start)
+
+    async def arrive(self, kind, params):
+        if kind == "tts":
+            await self.run_tts(params)
+            return
+        message = self.build_mention(params)
+        self.arrivals[message.id] = time.monotonic()
+        self.mentions[message.id] = message
+        await self.handler.on_message(message)
+
+    async def run(self):
+        await self.setup()
+        shed_before = sum(metrics.MESSAGES_SHED.values.values())
+        retries_before = sum(metrics.API_RETRIES.values.values())
+        begin = time.monotonic()
+        try:
+            for delay, kind, params in self.workload:
+                if delay:
+                    await asyncio.sleep(delay)
+                self.pending.append(asyncio.create_task(self.arrive(kind, params)))
+            await asyncio.gather(*self.pending)
+            shed = sum(metrics.MESSAGES_SHED.values.values()) - shed_before
+            expected = len(self.arrivals) - shed
+            deadline = time.monotonic() + self.args.timeout
+            while len(self.finished) < expected and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+        finally:
+            await self.teardown()
+        answered = self.answered
+        end = max(answered.values()) if answered else max(self.finished.values(), default=time.monotonic())
+        return self.report(begin, end, shed, sum(metrics.API_RETRIES.values.values()) - retries_before)
+
+    async def teardown(self):
+        workers = list(self.handler.workers)
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if self.bot.trace_recorder is not None:
+            await self.bot.trace_recorder.close()
+        await self.bot.close()
+        await self.provider.stop()
+
+    @property
+    def answered(self):
+        """Message id -> time the last reply chunk was sent, which is when the user has the full answer."""
+        return {mid: message.replies[-1][0] for mid, message in self.mentions.items() if message.replies}
+
+    def report(self, begin, end, shed, retries):
+        done = [mid for mid in self.finished if mid in self.arrivals]
+        answered = self.answered
+        elapsed = max(end - begin, 1e-9)
+        return {
+            "messages": len(self.arrivals),
+            "completed": len(done),
+            "shed": shed,
+            "tts": len(self.tts_latencies),
+            "elapsed": elapsed,
+            "throughput": len(done) / elapsed,
+            "queue_wait": summarize([self.started[mid] - self.arrivals[mid] for mid in done]),
+            "end_to_end": summarize([answered[mid] - self.arrivals[mid] for mid in done if mid in answered]),
+            "handling": summarize([self.finished[mid] - self.started[mid] for mid in done]),
+            "tts_latency": summarize(self.tts_latencies),
+            "upstream_requests": self.provider.requests,
+            "upstream_429": self.provider.rejected,
+            "retries": retries,
+        }
+
+def format_report(results):
+    lines = [
+        f"messages: {results['messages']} sent, {results['completed']} completed, {results['shed']} shed by cooldown, {results['tts']} /aitts",
+        f"elapsed: {results['elapsed']:.1f}s, throughput: {results['throughput']:.2f} msg/s",
+        f"upstream: {results['upstream_requests']} requests, {results['upstream_429']} injected 429s, {results['retries']} retries",
+        "",
+        f"{'':<12}{'count':>7}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}",
+    ]
+    for name in ("queue_wait", "end_to_end", "handling", "tts_latency"):
+        stats = results[name]
+        if not stats["count"]:
+            continue
+        lines.append(f"{name:<12}{stats['count']:>7}" + "".join(f"{stats[k]:>8.3f}s" for k in ("mean", "p50", "p95", "p99", "max")))
+    return "\n".join(lines)
+
+def add_workload_arguments(parser):
+    group = parser.add_argument_group("workload")
+    group.add_argument("--messages", type=int, default=200, help="number of arrivals")
+    group.add_argument("--rate", type=float, default=10.0, help="mean arrivals per second (Poisson); 0 sends all at once")
+    group.add_argument("--users", type=int, default=500, help="distinct synthetic users (the per-user cooldown sheds repeats)")
+    group.add_argument("--channels", type=int, default=5)
+    group.add_argument("--reply-share", type=float, default=0.4, help="share of mentions that reply to an earlier message")
+    group.add_argument("--reply-depth", type=int, default=5, help="maximum reply chain depth")
+    group.add_argument("--image-share", type=float, default=0.1, help="share of mentions with an image attachment")
+    group.add_argument("--xai-share", type=float, default=0.3, help="share of users who selected xAI")
+    group.add_argument("--tts-share", type=float, default=0.05, help="share of arrivals that are /aitts commands")
+
+def add_environment_arguments(parser):
+    group = parser.add_argument_group("environment")
+    group.add_argument("--search-latency", type=float, default=0.3, help="seconds per web_search call")
+    group.add_argument("--fetch-latency", type=float, default=0.05, help="seconds per Discord fetch_message call")
+    group.add_argument("--send-latency", type=float, default=0.05, help="seconds per Discord reply")
+    group.add_argument("--api-timeout", type=int, default=60)
+    group.add_argument("--timeout", type=float, default=300, help="seconds to wait for the queue to drain")
+    group.add_argument("--seed", type=int, default=1234)
+    group.add_argument("--verbose", action="store_true", help="show the bot's INFO logs on the console")
+    group.add_argument("--record-trace", help="record the handled messages to this trace file (see benchmarks/replay.py)")
+
+def configure_logging(verbose):
+    if not verbose:
+        config.console_handler.setLevel(logging.WARNING)
+
+def check_thresholds(results, args):
+    failures = []
+    p95 = results["end_to_end"]["p95"]
+    if args.max_p95 is not None and (p95 is None or p95 > args.max_p95):
+        failures.append(f"end-to-end p95 {p95}s exceeds {args.max_p95}s")
+    if args.min_throughput is not None and results["throughput"] < args.min_throughput:
+        failures.append(f"throughput {results['throughput']:.2f} msg/s below {args.min_throughput}")
+    if results["completed"] < results["messages"] - results["shed"]:
+        failures.append(f"only {results['completed']} of {results['messages'] - results['shed']} queued messages completed")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_workload_arguments(parser)
+    add_arguments(parser)
+    add_environment_arguments(parser)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--max-p95", type=float, help="fail if end-to-end p95 exceeds this many seconds")
+    parser.add_argument("--min-throughput", type=float, help="fail if throughput is below this many messages per second")
+    args = parser.parse_args()
+    configure_logging(args.verbose)
+
+    results = asyncio.run(LoadTest(args).run())
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    failures = check_thresholds(results, args)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Replay recorded traffic traces through the message pipeline and compare builds.
+
+Traces are recorded by the bot when TRACE_FILE is set (or by
+benchmarks.loadtest --record-trace). Replaying feeds one synthetic mention per
+record through the real MessageHandler, reproducing its arrival time, reply
+chain depth, context size, image attachment and API choice, while the stub
+provider reproduces each upstream call's latency and tool-call shape and
+web_search reproduces the recorded search latencies.
+
+    python -m benchmarks.replay run traces.jsonl.gz --speed 4 --json build-a.json
+    git checkout other-build
+    python -m benchmarks.replay run traces.jsonl.gz --speed 4 --json build-b.json
+    python -m benchmarks.replay compare build-a.json build-b.json
+
+Each bot process appending to a trace file starts a new recording session;
+sessions are replayed one after another. --speed divides arrival gaps and
+stubbed latencies; the bot's own pacing (batch timeout, the delay between
+reply chunks) still runs in real time.
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+from benchmarks.fake_provider import FakeProvider, FakeProviderConfig
+from benchmarks.fakes import FakeChannel, FakeUser
+from benchmarks.loadtest import LoadTest, add_environment_arguments, configure_logging, format_report
+from grokbot.tracing import read_traces
+
+TAG = re.compile(r"\[replay (\d+)\]")
+ANSWER_SUFFIX_CHARS = len("\n(answered by OpenAI)")
+
+def upstream_calls(record):
+    return [call for call in record.get("calls", []) if not call.get("cached")]
+
+def find_tag(text):
+    match = TAG.search(text or "")
+    return int(match.group(1)) if match else None
+
+class ReplayProvider(FakeProvider):
+    def __init__(self, records, speed):
+        super().__init__(FakeProviderConfig(rate_429=0.0))
+        self.records = records
+        self.speed = speed
+
+    def index_for(self, messages):
+        for message in messages:
+            if message.get("role") == "user":
+                content = message.get("content")
+                if isinstance(content, list):
+                    content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+                index = find_tag(content)
+                if index is not None:
+                    return index
+        return None
+
+    def record_for(self, messages):
+        index = self.index_for(messages)
+        return self.records[index] if index is not None else {}
+
+    def latency_for(self, request_body):
+        messages = request_body.get("messages", [])
+        calls = upstream_calls(self.record_for(messages))
+        iteration = sum(1 for m in messages if m.get("role") == "tool")
+        if iteration < len(calls):
+            return calls[iteration].get("lat", 0.0) / self.speed
+        return super().latency_for(request_body) / self.speed
+
+    def tool_calls_for(self, messages):
+        return sum(1 for call in upstream_calls(self.record_for(messages)) if call.get("tools"))
+
+    def answer_chars_for(self, messages):
+        return max(1, self.record_for(messages).get("out", self.config.answer_chars) - ANSWER_SUFFIX_CHARS)
+
+    def tool_query_for(self, messages, iteration):
+        return f"[replay {self.index_for(messages)}] search {iteration}"
+
+class ReplayLoadTest(LoadTest):
+    def __init__(self, args, records):
+        self.records = records
+        self.searches = {}
+        super().__init__(args, workload=self.build_workload(args.speed))
+
+    def build_workload(self, speed):
+        # A trace file spanning restarts holds one timeline per bot process; play them back to back
+        sessions = {}
+        for index, record in enumerate(self.records):
+            sessions.setdefault(record.get("s", 0), []).append((record.get("t", 0), index))
+        previous = None
+        offset = 0.0
+        workload = []
+        for session in sorted(sessions):
+            for t, index in sorted(sessions[session]):
+                arrival = offset + t
+                delay = 0.0 if previous is None else max(0.0, arrival - previous) / speed
+                previous = arrival
+                workload.append((delay, "mention", {"index": index}))
+            offset = previous
+        return workload
+
+    def make_provider(self):
+        return ReplayProvider(self.records, self.args.speed)
+
+    async def fake_search(self, query):
+        index = find_tag(query)
+        latencies = self.searches.setdefault(index, list(self.records[index].get("search", [])) if index is not None else [])
+        await asyncio.sleep((latencies.pop(0) if latencies else self.args.search_latency) / self.args.speed)
+        return f"Search results for {query}\n" + "snippet text " * 200
+
+    def channel_for(self, params):
+        record = self.records[params["index"]]
+        lookups = record.get("depth", 0) + (1 if record.get("images") and record.get("depth") else 0)
+        fetch_latency = record.get("fetch", 0.0) / lookups / self.args.speed if lookups else 0.0
+        return FakeChannel(self.guild, fetch_latency=fetch_latency)
+
+    def author_for(self, params):
+        # Recorded messages already passed the per-user cooldown, so each gets its own user
+        user = FakeUser(f"replay{params['index']}")
+        self.guild.add_member(user)
+        self.bot.user_api_selection[user.id] = self.records[params["index"]].get("api", "openai")
+        return user
+
+    def send_latency_for(self, params):
+        record = self.records[params["index"]]
+        return record.get("send", 0.0) / max(1, record.get("chunks", 1)) / self.args.speed
+
+    def build_mention(self, params):
+        record = self.records[params["index"]]
+        depth = record.get("depth", 0)
+        context_chars = record.get("ctx", 100)
+        history_chars = context_chars // (2 * depth) if depth else 0
+        question_chars = max(20, context_chars - depth * history_chars)
+        tag = f"[replay {params['index']}] "
+        return super().build_mention({
+            "question": tag + "q" * max(0, question_chars - len(tag)),
+            "depth": depth,
+            "image": bool(record.get("images")),
+            "history_chars": history_chars,
+            "index": params["index"],
+        })
+
+def compare(a, b, names):
+    rows = [("throughput (msg/s)", a["throughput"], b["throughput"])]
+    for section in ("queue_wait", "end_to_end"):
+        for key in ("mean", "p50", "p95", "p99", "max"):
+            rows.append((f"{section} {key} (s)", a[section][key], b[section][key]))
+    rows.append(("completed", a["completed"], b["completed"]))
+    lines = [f"{'':<24}{names[0]:>14}{names[1]:>14}{'change':>10}"]
+    for label, old, new in rows:
+        if old is None or new is None:
+            lines.append(f"{label:<24}{str(old):>14}{str(new):>14}")
+            continue
+        change = f"{(new - old) / old:+.1%}" if old else "n/a"
+        lines.append(f"{label:<24}{old:>14.3f}{new:>14.3f}{change:>10}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run = subparsers.add_parser("run", help="replay a trace file against stubbed providers")
+    run.add_argument("trace", help="trace file written by the bot (TRACE_FILE)")
+    run.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded")
+    run.add_argument("--json", help="write the results to this file for 'compare'")
+    add_environment_arguments(run)
+    diff = subparsers.add_parser("compare", help="compare the latency distributions of two replay results")
+    diff.add_argument("before")
+    diff.add_argument("after")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        print(compare(before, after, (args.before, args.after)))
+        return
+
+    configure_logging(args.verbose)
+    records = read_traces(args.trace)
+    if not records:
+        sys.exit(f"No records in {args.trace}")
+    args.users = args.channels = 1
+    args.xai_share = 0.0
+    print(f"Replaying {len(records)} messages at {args.speed}x")
+    results = asyncio.run(ReplayLoadTest(args, records).run())
+    results["trace"] = args.trace
+    results["speed"] = args.speed
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 import aiohttp
 import asyncio
 import logging
-import json
+import time
 from ddgs import DDGS
 from cachetools import LRUCache
-import hashlib
+from grokbot.config import API_RETRIES
+from grokbot.serialization import PayloadEncoder, dumps, loads
+from grokbot.metrics import (
+    STAGE_SECONDS, API_REQUESTS, API_RETRIES as API_RETRIES_TOTAL, API_ERRORS,
+    API_RATE_LIMITED, API_IN_FLIGHT, CACHE_HITS, CACHE_MISSES
+)
+from grokbot import tracing, usage
 
 # Initialize cache (max 100 entries, TTL 1 hour)
 api_cache = LRUCache(maxsize=100)
@@ -40,10 +46,14 @@ async def web_search(query):
                 return summary.strip()
             else:
                 return f"No results found for '{query}'"
+    start = time.perf_counter()
     try:
-        return await asyncio.to_thread(sync_search)
+        with STAGE_SECONDS.time("web_search"):
+            return await asyncio.to_thread(sync_search)
     except Exception as e:
         return f"Error performing search for '{query}': {str(e)}"
+    finally:
+        tracing.append("search", round(time.perf_counter() - start, 3))
 
 tools_map = {
     "web_search": web_search
@@ -52,48 +62,109 @@ tools_map = {
 class APIRetriesExceededError(Exception):
     """Raised when API request fails after maximum retries."""
 
-async def send_api_request(session, api_url, headers, payload, api_timeout):
-    # Create a cache key based on payload
-    cache_key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
-    
-    # Check cache
-    if cache_key in api_cache:
-        logging.info(f"Cache hit for API request: {cache_key}")
-        return api_cache[cache_key]
-    
-    retries = 3
+class AudioTooLargeError(Exception):
+    """Raised when a speech response exceeds the allowed size."""
+
+async def _error_body(response):
+    if response is None:
+        return ""
+    try:
+        error_body = await response.text()
+        return error_body[:500]
+    except Exception:
+        return "<unable to read response body>"
+
+async def _post_with_retries(session, api_url, headers, body, api_timeout, read_response, kind):
+    retries = API_RETRIES
     for attempt in range(retries):
         response = None
+        API_REQUESTS.inc(kind)
         try:
-            if session.closed:
-                logging.warning("Session closed, creating new aiohttp session")
-                session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=50))
-            async with session.post(api_url, headers=headers, json=payload, timeout=api_timeout) as response:
-                response.raise_for_status()
-                response_data = await response.json()
-                # Store in cache
-                api_cache[cache_key] = response_data
-                logging.info(f"Cached API response for key: {cache_key}")
-                return response_data
+            data = aiohttp.BytesPayload(body, content_type="application/json")
+            API_IN_FLIGHT.inc()
+            try:
+                async with session.post(api_url, headers=headers, data=data, timeout=api_timeout) as response:
+                    response.raise_for_status()
+                    return await read_response(response)
+            finally:
+                API_IN_FLIGHT.dec()
         except aiohttp.ClientResponseError as e:
+            if e.status == 429:
+                API_RATE_LIMITED.inc()
             if e.status == 429 and attempt < retries - 1:
+                API_RETRIES_TOTAL.inc("rate_limit")
                 await asyncio.sleep(2 ** attempt)
                 continue
             else:
-                error_body = ""
-                if response is not None:
-                    try:
-                        error_body = await response.text()
-                        error_body = error_body[:500]
-                    except Exception:
-                        error_body = "<unable to read response body>"
+                error_body = await _error_body(response)
                 logging.error(f"API error: HTTP {e.status}: {error_body}")
+                API_ERRORS.inc()
                 raise
+        except ValueError as e:
+            # A successful status with a body that isn't JSON, such as a proxy's HTML error page
+            error_body = await _error_body(response)
+            logging.error(f"API error: invalid JSON response ({str(e)}): {error_body}")
+            API_ERRORS.inc()
+            raise
         except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
             if attempt < retries - 1:
+                API_RETRIES_TOTAL.inc("connection")
                 await asyncio.sleep(2 ** attempt)
                 continue
             else:
                 logging.error(f"Connection error: {str(e)}")
+                API_ERRORS.inc()
                 raise
-    raise APIRetriesExceededError("Failed to get response after retries")
\ No newline at end of file
+    raise APIRetriesExceededError("Failed to get response after retries")
+
+async def _read_json(response):
+    body = await response.read()
+    return loads(body), len(body)
+
+async def send_api_request(session, api_url, headers, payload, api_timeout):
+    # payload may be a plain dict or a PayloadEncoder reused across tool iterations
+    if not isinstance(payload, PayloadEncoder):
+        payload = PayloadEncoder.from_payload(payload)
+    # Create a cache key based on payload
+    cache_key = payload.cache_key()
+
+    # Check cache
+    if cache_key in api_cache:
+        logging.info(f"Cache hit for API request: {cache_key}")
+        CACHE_HITS.inc("api")
+        tracing.append("calls", {"cached": True})
+        return api_cache[cache_key]
+    CACHE_MISSES.inc("api")
+
+    body = payload.body()
+    start = time.perf_counter()
+    with STAGE_SECONDS.time("api_request"):
+        response_data, response_size = await _post_with_retries(session, api_url, headers, body, api_timeout, _read_json, "chat")
+    usage.record_response(response_data)
+    choices = response_data.get("choices") or [{}]
+    tracing.append("calls", {
+        "lat": round(time.perf_counter() - start, 3),
+        "req": len(body),
+        "resp": response_size,
+        "tools": len(choices[0].get("message", {}).get("tool_calls") or [])
+    })
+    # Store in cache
+    api_cache[cache_key] = response_data
+    logging.info(f"Cached API response for key: {cache_key}")
+    return response_data
+
+async def _read_capped(response, max_bytes):
+    # Bail out before buffering anything if the server already told us it's too big
+    if response.content_length is not None and response.content_length > max_bytes:
+        raise AudioTooLargeError(f"Audio response is {response.content_length} bytes (limit {max_bytes})")
+    data = bytearray()
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        data.extend(chunk)
+        if len(data) > max_bytes:
+            raise AudioTooLargeError(f"Audio response exceeded {max_bytes} bytes")
+    return bytes(data)
+
+async def send_speech_request(session, api_url, headers, payload, api_timeout, max_bytes):
+    """Stream a speech response, aborting as soon as it grows past max_bytes."""
+    with STAGE_SECONDS.time("tts_request"):
+        return await _post_with_retries(session, api_url, headers, dumps(payload), api_timeout, lambda response: _read_capped(response, max_bytes), "speech")
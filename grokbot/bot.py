@@ -10,19 +10,33 @@ import time
 from grokbot.config import *
 from grokbot.utils import *
 from grokbot.api import *
+from grokbot.tts_cache import TTSCache
+from grokbot.providers import build_providers
+from grokbot.metrics import QUEUE_DEPTH, start_metrics_server
+from grokbot.profiling import LoopLagMonitor
+from grokbot.tracing import TraceRecorder
+from grokbot.usage import UsageTracker
 
 class GrokBot(commands.AutoShardedBot):
     def __init__(self):
         intents = discord.Intents.default()
         intents.message_content = True
         super().__init__(command_prefix="!", intents=intents)
-        self.session = None
         self.message_queue = asyncio.Queue()
+        QUEUE_DEPTH.set_function(self.message_queue.qsize)
+        self.metrics_runner = None
+        self.loop_monitor = LoopLagMonitor(LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD)
+        self.trace_recorder = TraceRecorder(TRACE_FILE, TRACE_FLUSH_INTERVAL) if TRACE_FILE else None
         self.user_api_selection = {}
         self.react_user_id = None
         self.user_pref_lock = asyncio.Lock()
         self.user_pref_dirty = False
         self.user_pref_last_write = 0
+        self.draining = False
+        self.restore_task = None
+        self.restore_entries = []  # pending entries from the last shutdown not yet re-queued
+        self.usage = UsageTracker(TOKEN_BUDGET_WINDOW, USER_TOKEN_BUDGET, GUILD_TOKEN_BUDGET)
+        self.usage_loaded = False
         self.MAX_TOKENS = MAX_TOKENS
         self.WORKER_COUNT = WORKER_COUNT
         self.BOT_OWNER_ID = BOT_OWNER_ID
@@ -34,6 +48,10 @@ class GrokBot(commands.AutoShardedBot):
         self.XAI_CHAT_URL = XAI_CHAT_URL
         self.OPENAI_CHAT_URL = OPENAI_CHAT_URL
         self.OPENAI_VOICE_URL = OPENAI_VOICE_URL
+        self.OPENAI_TTS_MODEL = OPENAI_TTS_MODEL
+        self.tts_cache = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+        self.tts_cache_loaded = False
+        self.providers = build_providers(self)
         self.test_guild_id = None  # Replace with your guild ID or None for global sync
         self.last_sync_time = 0
         self.sync_interval = 3600  # Sync every hour if needed
@@ -58,10 +76,37 @@ class GrokBot(commands.AutoShardedBot):
                         logging.info(f"Loaded user preferences for {len(self.user_api_selection)} users.")
         except Exception as e:
             logging.error(f"Error loading user preferences: {str(e)}")
+        # on_ready fires again after reconnects; reloading would replace usage recorded since the last save
+        if not self.usage_loaded:
+            self.usage_loaded = True
+            try:
+                if USAGE_FILE.exists():
+                    async with aiofiles.open(USAGE_FILE, 'r') as f:
+                        content = await f.read()
+                        if content:
+                            self.usage.load_dict(json.loads(content))
+                            logging.info(f"Loaded token usage for {len(self.usage.totals['users'])} users.")
+            except Exception as e:
+                logging.error(f"Error loading token usage: {str(e)}")
+
+        for provider in self.providers.values():
+            if provider.configured:
+                provider.get_session()
 
-        if self.session is None:
-            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=50))
-            logging.info("Created new aiohttp ClientSession")
+        # Reloading after a reconnect would delete temp files of in-flight writes and rebuild the index under them
+        if not self.tts_cache_loaded:
+            self.tts_cache_loaded = True
+            await self.tts_cache.load()
+
+        if METRICS_PORT and self.metrics_runner is None:
+            try:
+                self.metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+            except Exception as e:
+                logging.error(f"Failed to start metrics endpoint: {str(e)}")
+        if self.loop_monitor.task is None:
+            self.loop_monitor.start()
+        if self.trace_recorder is not None and self.trace_recorder.task is None:
+            self.trace_recorder.start()
 
         # Load cogs
         try:
@@ -72,6 +117,20 @@ class GrokBot(commands.AutoShardedBot):
         except Exception as e:
             logging.error(f"Failed to load cogs: {str(e)}")
 
+        self.loop.create_task(self.save_user_prefs_periodically())
+        def _register_shutdown():
+            loop = asyncio.get_event_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, lambda: asyncio.create_task(self.shutdown()))
+                except NotImplementedError:
+                    pass
+        _register_shutdown()
+
+        # Re-fetching can be slow under rate limits, so it runs after shutdown handling is in place
+        if self.restore_task is None:
+            self.restore_task = self.loop.create_task(self.restore_pending_messages())
+
         # Sync commands if needed
         current_time = time.time()
         if current_time - self.last_sync_time > self.sync_interval:
@@ -95,15 +154,6 @@ class GrokBot(commands.AutoShardedBot):
                     else:
                         logging.error(f"Failed to sync commands after {retries} attempts: {str(e)}")
 
-        self.loop.create_task(self.save_user_prefs_periodically())
-        def _register_shutdown():
-            loop = asyncio.get_event_loop()
-            for sig in (signal.SIGINT, signal.SIGTERM):
-                try:
-                    loop.add_signal_handler(sig, lambda: asyncio.create_task(self.shutdown()))
-                except NotImplementedError:
-                    pass
-        _register_shutdown()
 
     async def on_disconnect(self):
         logging.warning("Bot disconnected from Discord (WebSocket closed). Waiting for automatic reconnect...")
@@ -128,8 +178,59 @@ class GrokBot(commands.AutoShardedBot):
                         logging.info("User preferences saved periodically.")
                     except Exception as e:
                         logging.error(f"Failed to save user preferences periodically: {str(e)}")
+            await self.save_usage()
+
+    async def save_usage(self):
+        if not self.usage.dirty:
+            return
+        try:
+            # Clear the flag first so usage recorded during the write is saved next time
+            self.usage.dirty = False
+            async with aiofiles.open(USAGE_FILE, 'w') as f:
+                await f.write(json.dumps(self.usage.to_dict()))
+        except Exception as e:
+            self.usage.dirty = True
+            logging.error(f"Failed to save token usage: {str(e)}")
+
+    async def restore_pending_messages(self):
+        handler = self.get_cog("MessageHandler")
+        if handler is None or not PENDING_QUEUE_FILE.exists():
+            return
+        try:
+            async with aiofiles.open(PENDING_QUEUE_FILE, 'r') as f:
+                content = await f.read()
+            self.restore_entries = json.loads(content) if content else []
+            await handler.restore(self.restore_entries, QUEUE_FRESHNESS)
+            # Only forget the file once everything in it is queued; until then a shutdown saves the rest
+            PENDING_QUEUE_FILE.unlink(missing_ok=True)
+        except Exception as e:
+            logging.error(f"Error restoring pending messages: {str(e)}")
+
+    async def save_pending_messages(self, messages, entries=()):
+        entries = list(entries) + [{"channel_id": m.channel.id, "message_id": m.id, "created_at": m.created_at.timestamp()} for m in messages]
+        try:
+            if not entries:
+                PENDING_QUEUE_FILE.unlink(missing_ok=True)
+                return
+            async with aiofiles.open(PENDING_QUEUE_FILE, 'w') as f:
+                await f.write(json.dumps(entries))
+            logging.info(f"Saved {len(entries)} unanswered messages for the next start.")
+        except Exception as e:
+            logging.error(f"Failed to save pending messages: {str(e)}")
 
     async def shutdown(self):
+        if self.draining:
+            return
+        self.draining = True
+        logging.info(f"Shutting down: draining the message queue for up to {DRAIN_TIMEOUT}s")
+        if self.restore_task is not None and not self.restore_task.done():
+            self.restore_task.cancel()
+            await asyncio.gather(self.restore_task, return_exceptions=True)
+        handler = self.get_cog("MessageHandler")
+        unanswered = []
+        if handler is not None:
+            unanswered = await handler.drain(DRAIN_TIMEOUT)
+            await self.save_pending_messages(unanswered, self.restore_entries)
         async with self.user_pref_lock:
             if self.user_pref_dirty:
                 try:
@@ -141,14 +242,21 @@ class GrokBot(commands.AutoShardedBot):
                     logging.info("User preferences saved on shutdown.")
                 except Exception as e:
                     logging.error(f"Failed to save user preferences on shutdown: {str(e)}")
-        if self.session is not None and not self.session.closed:
-            try:
-                await self.session.close()
-                logging.info("Closed aiohttp ClientSession")
-            except Exception as e:
-                logging.error(f"Failed to close aiohttp session: {str(e)}")
-            finally:
-                self.session = None
+        await self.save_usage()
+        for provider in self.providers.values():
+            await provider.close()
+        self.loop_monitor.stop()
+        if self.trace_recorder is not None:
+            await self.trace_recorder.close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+            self.metrics_runner = None
+        # on_message keeps holding mentions until close(); save any that arrived since the drain
+        while handler is not None and handler.held:
+            unanswered += handler.held
+            handler.held = []
+            await self.save_pending_messages(unanswered, self.restore_entries)
+        await self.close()
 
 if __name__ == "__main__":
     if DISCORD_TOKEN is None:
@@ -2,12 +2,16 @@ from discord import app_commands
 from discord.ext import commands
 import discord
 import asyncio
+import io
 from grokbot.utils import tail, split_log_lines
-from grokbot.config import BOT_OWNER_ID
+from grokbot.config import BOT_OWNER_ID, LOG_FILE
+from grokbot.metrics import format_stats
+from grokbot.profiling import profile_cpu, snapshot_memory
 
 class AdminCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.profiling = False
 
     def is_authorized_user():
         async def predicate(interaction: discord.Interaction) -> bool:
@@ -23,7 +27,7 @@ class AdminCommands(commands.Cog):
     async def checklog(self, interaction: discord.Interaction):
         await interaction.response.defer()
         try:
-            log_lines = await tail('/app/logs/bot.log', 50)
+            log_lines = await tail(LOG_FILE, 50)
             if log_lines and isinstance(log_lines[0], str) and "Error" in log_lines[0]:
                 await interaction.followup.send(log_lines[0])
                 return
@@ -37,6 +41,56 @@ class AdminCommands(commands.Cog):
         except Exception as e:
             await interaction.followup.send(f"Error retrieving log file: {str(e)}")
 
+    @app_commands.command(name="stats", description="Show queue, API, cache and latency statistics")
+    @is_authorized_user()
+    async def stats(self, interaction: discord.Interaction):
+        await interaction.response.send_message(f"```\n{format_stats()[:1980]}```", ephemeral=True)
+
+    @app_commands.command(name="topusage", description="Show the users and servers using the most tokens")
+    @is_authorized_user()
+    async def topusage(self, interaction: discord.Interaction):
+        usage = self.bot.usage
+        window_minutes = usage.window // 60
+        lines = [f"Tokens used in the last {window_minutes} minutes (all time in brackets)"]
+        for scope, title in (("users", "Users"), ("guilds", "Servers")):
+            lines.append(f"\n{title}:")
+            rows = usage.top(scope, 10)
+            if not rows:
+                lines.append("  none")
+            for key, used, total in rows:
+                lines.append(f"  {key}: {used} ({total})")
+        await interaction.response.send_message(f"```\n{chr(10).join(lines)[:1980]}```", ephemeral=True)
+
+    @app_commands.command(name="profile", description="Capture a CPU profile of the bot for a number of seconds")
+    @app_commands.describe(seconds="How long to profile for (1-60 seconds)")
+    @is_authorized_user()
+    async def profile(self, interaction: discord.Interaction, seconds: app_commands.Range[int, 1, 60] = 10):
+        await self.run_profiler(interaction, "CPU profile", profile_cpu, seconds, "cpu_profile.txt")
+
+    @app_commands.command(name="memsnapshot", description="Trace memory allocations for a number of seconds")
+    @app_commands.describe(seconds="How long to trace allocations for (1-60 seconds)")
+    @is_authorized_user()
+    async def memsnapshot(self, interaction: discord.Interaction, seconds: app_commands.Range[int, 1, 60] = 10):
+        await self.run_profiler(interaction, "Memory snapshot", snapshot_memory, seconds, "memory_snapshot.txt")
+
+    async def run_profiler(self, interaction, label, capture, seconds, filename):
+        if self.profiling:
+            await interaction.response.send_message("A profile is already being captured.", ephemeral=True)
+            return
+        self.profiling = True
+        await interaction.response.defer(ephemeral=True)
+        try:
+            report = await capture(seconds)
+            await interaction.followup.send(
+                f"{label} over {seconds} seconds:",
+                file=discord.File(io.BytesIO(report.encode()), filename=filename),
+                ephemeral=True
+            )
+        except Exception as e:
+            await interaction.followup.send(f"Error capturing {label.lower()}: {str(e)}", ephemeral=True)
+        finally:
+            self.profiling = False
+
     @app_commands.command(name="setreactuser", description="Set the user whose messages will be reacted with 🌈")
     @is_authorized_user()
     async def set_react_user(self, interaction: discord.Interaction, user: discord.User):
@@ -4,13 +4,43 @@ import discord
 import datetime
 import logging
 import io
-from grokbot.api import send_api_request
-from grokbot.config import BOT_OWNER_ID
+from grokbot.api import AudioTooLargeError
+from grokbot.config import BOT_OWNER_ID, MAX_AUDIO_BYTES
+from grokbot.tts_cache import TTSCache
+from grokbot import usage
 
 class AICommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def refuse_if_over_budget(self, interaction):
+        refusal = self.bot.usage.check(interaction.user.id, interaction.guild.id if interaction.guild else None)
+        if refusal:
+            await interaction.response.send_message(refusal, ephemeral=True)
+            return True
+        return False
+
+    async def ask_about_member(self, interaction, member, prompt):
+        """Ask OpenAI a question about a member, passing their avatar along with the prompt."""
+        avatar_url = member.avatar.url if member.avatar else member.default_avatar.url
+        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        messages = [
+            {"role": "system", "content": f"The current date and time is {current_time}."},
+            {"role": "user", "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": avatar_url}}
+            ]}
+        ]
+        provider = self.bot.providers["openai"]
+        payload = {
+            "model": provider.model,
+            "messages": messages,
+            "max_tokens": self.bot.MAX_TOKENS,
+        }
+        with usage.charge(self.bot.usage, interaction.user.id, interaction.guild.id if interaction.guild else None):
+            response = await provider.chat(payload)
+        return response["choices"][0]["message"]["content"]
+
     @app_commands.command(name="selectapi", description="Select the AI API (xAI or OpenAI)")
     @app_commands.describe(api="API to use (xAI or OpenAI)")
     @app_commands.choices(api=[
@@ -18,11 +48,8 @@ class AICommands(commands.Cog):
         app_commands.Choice(name="OpenAI", value="openai")
     ])
     async def selectapi(self, interaction: discord.Interaction, api: app_commands.Choice[str]):
-        if api.value == "xai" and not self.bot.XAI_API_KEY:
-            await interaction.response.send_message("xAI API is not configured.", ephemeral=True)
-            return
-        elif api.value == "openai" and not self.bot.OPENAI_API_KEY:
-            await interaction.response.send_message("OpenAI API is not configured.", ephemeral=True)
+        if not self.bot.providers[api.value].configured:
+            await interaction.response.send_message(f"{api.name} API is not configured.", ephemeral=True)
             return
 
         async with self.bot.user_pref_lock:
@@ -35,34 +62,16 @@ class AICommands(commands.Cog):
     @app_commands.describe(member="The user to roast", context="Optional additional context about the user")
     @app_commands.checks.cooldown(1, 10)
     async def airoast(self, interaction: discord.Interaction, member: discord.Member, context: str = None):
+        if await self.refuse_if_over_budget(interaction):
+            return
         await interaction.response.defer()
         try:
             display_name = member.global_name
-            avatar_url = member.avatar.url if member.avatar else member.default_avatar.url
             prompt = f"Roast this user in a funny way based on their nickname '{display_name}' and their avatar. Make it humorous and don't be afraid of offensive jokes since it's a roast between friends and should not be taken seriously."
             if context and context.strip():
                 context = context.strip()[:500]
                 prompt += f" Additional context: {context}"
-            current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            messages = [
-                {"role": "system", "content": f"The current date and time is {current_time}."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": avatar_url}}
-                ]}
-            ]
-            payload = {
-                "model": self.bot.OPENAI_MODEL,
-                "messages": messages,
-                "max_tokens": self.bot.MAX_TOKENS,
-            }
-            headers = {
-                "Authorization": f"Bearer {self.bot.OPENAI_API_KEY}",
-                "Content-Type": "application/json",
-                "User-Agent": "GrokBot/1.0"
-            }
-            response = await send_api_request(self.bot.session, self.bot.OPENAI_CHAT_URL, headers, payload, self.bot.API_TIMEOUT)
-            answer = response["choices"][0]["message"]["content"]
+            answer = await self.ask_about_member(interaction, member, prompt)
             await interaction.followup.send(f"Roast for {member.mention}: {answer}")
         except Exception as e:
             logging.error(f"Error in airoast command: {e}")
@@ -72,34 +81,16 @@ class AICommands(commands.Cog):
     @app_commands.describe(member="The user to motivate", context="Optional additional context about the user")
     @app_commands.checks.cooldown(1, 10)
     async def aimotivate(self, interaction: discord.Interaction, member: discord.Member, context: str = None):
+        if await self.refuse_if_over_budget(interaction):
+            return
         await interaction.response.defer()
         try:
             display_name = member.global_name
-            avatar_url = member.avatar.url if member.avatar else member.default_avatar.url
             prompt = f"Give this user, {display_name}, some extremely cheesy and over-the-top motivational advice based on their nickname and their avatar. Make it as exaggerated and uplifting as possible. Don't hold back on the enthusiasm!"
             if context:
                 context = context.strip()[:500]
                 prompt += f" Additional context: {context}"
-            current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            messages = [
-                {"role": "system", "content": f"The current date and time is {current_time}."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": avatar_url}}
-                ]}
-            ]
-            payload = {
-                "model": self.bot.OPENAI_MODEL,
-                "messages": messages,
-                "max_tokens": self.bot.MAX_TOKENS,
-            }
-            headers = {
-                "Authorization": f"Bearer {self.bot.OPENAI_API_KEY}",
-                "Content-Type": "application/json",
-                "User-Agent": "GrokBot/1.0"
-            }
-            response = await send_api_request(self.bot.session, self.bot.OPENAI_CHAT_URL, headers, payload, self.bot.API_TIMEOUT)
-            answer = response["choices"][0]["message"]["content"]
+            answer = await self.ask_about_member(interaction, member, prompt)
             await interaction.followup.send(f"Motivational advice for {member.mention}: {answer}")
         except Exception as e:
             logging.error(f"Error in aimotivate command: {e}")
@@ -125,27 +116,24 @@ class AICommands(commands.Cog):
     ])
     @app_commands.checks.cooldown(1, 10)
     async def aitts(self, interaction: discord.Interaction, text: str, voice: app_commands.Choice[str], context: str = None):
+        if await self.refuse_if_over_budget(interaction):
+            return
         await interaction.response.defer()
         try:
             text = text.strip()
             if len(text) > 4096:
                 await interaction.followup.send("The text is too long. Please limit it to 4096 characters.")
                 return
+            cache_key = TTSCache.make_key(text, voice.value, self.bot.OPENAI_TTS_MODEL)
             payload = {
-                "model": "gpt-4o-mini-tts",
+                "model": self.bot.OPENAI_TTS_MODEL,
                 "input": text,
                 "voice": voice.value
             }
-            headers = {
-                "Authorization": f"Bearer {self.bot.OPENAI_API_KEY}",
-                "Content-Type": "application/json",
-                "User-Agent": "GrokBot/1.0"
-            }
-            async with self.bot.session.post(self.bot.OPENAI_VOICE_URL, headers=headers, json=payload) as response:
-                response.raise_for_status()
-                audio_data = await response.read()
-            file_size = len(audio_data)
-            if file_size > 8 * 1024 * 1024:
+            try:
+                audio_data = await self.bot.tts_cache.get_or_create(
+                    cache_key, lambda: self.bot.providers["openai"].speech(payload, MAX_AUDIO_BYTES))
+            except AudioTooLargeError:
                 await interaction.followup.send("The generated voice message is too large to send (over 8MB). Try shorter text.")
                 return
             audio_file = io.BytesIO(audio_data)
@@ -5,10 +5,14 @@ import logging
 import traceback
 import re
 import datetime
-import json
-from grokbot.api import send_api_request, tool_definitions, tools_map
+import time
+from contextlib import nullcontext
+from grokbot import tracing, usage
+from grokbot.api import tool_definitions, tools_map
+from grokbot.serialization import PayloadEncoder, loads
 from grokbot.utils import split_message
 from grokbot.config import WORKER_COUNT
+from grokbot.metrics import STAGE_SECONDS, MESSAGES_RECEIVED, MESSAGES_SHED, MESSAGES_IN_FLIGHT, WORKERS
 from discord.ext.commands import CooldownMapping, BucketType
 
 class MessageHandler(commands.Cog):
@@ -22,42 +26,101 @@ class MessageHandler(commands.Cog):
         self.batch_timeout = 1.0  # seconds to wait for batching
         self.max_batch_size = 5
         self.workers = []
+        self.target_workers = 0
+        self.enqueued_at = {}  # message id -> time.monotonic() when it was queued
+        self.in_hand = {}  # message id -> message taken off the queue but not yet answered
+        self.held = []  # mentions received while draining, answered after the restart
+        WORKERS.set_function(lambda: len(self.workers))
         self.adjust_workers()
 
     def adjust_workers(self):
         """Dynamically adjust the number of worker tasks based on queue size."""
         target_workers = min(max(2, self.bot.message_queue.qsize() // 5 + 2), WORKER_COUNT * 2)
+        self.target_workers = target_workers
         current_workers = len(self.workers)
         if target_workers > current_workers:
             for _ in range(target_workers - current_workers):
                 task = self.bot.loop.create_task(self.worker())
                 self.workers.append(task)
-        elif target_workers < current_workers:
-            for task in self.workers[target_workers:]:
-                task.cancel()
-            self.workers = self.workers[:target_workers]
-        logging.info(f"Adjusted to {len(self.workers)} workers (queue size: {self.bot.message_queue.qsize()})")
+        logging.info(f"Adjusted to {target_workers} workers (queue size: {self.bot.message_queue.qsize()})")
 
     async def worker(self):
         while True:
+            # Surplus workers retire between batches; cancelling one could drop messages it already dequeued
+            if len(self.workers) > self.target_workers:
+                self.workers.remove(asyncio.current_task())
+                break
+            messages = []
             try:
-                # Collect messages for batching
-                messages = [await self.bot.message_queue.get()]
+                # Collect messages for batching; each one is tracked in in_hand as soon as it
+                # leaves the queue so a drain that cancels this worker mid-batch still saves it
+                message = await self.bot.message_queue.get()
+                self.in_hand[message.id] = message
+                messages.append(message)
                 start_time = asyncio.get_event_loop().time()
                 while len(messages) < self.max_batch_size and (asyncio.get_event_loop().time() - start_time) < self.batch_timeout:
                     try:
                         message = await asyncio.wait_for(self.bot.message_queue.get(), timeout=self.batch_timeout)
-                        messages.append(message)
                     except asyncio.TimeoutError:
                         break
+                    self.in_hand[message.id] = message
+                    messages.append(message)
                 await self.handle_messages(messages)
-                for _ in messages:
-                    self.bot.message_queue.task_done()
                 self.adjust_workers()
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logging.error(f"Error in worker: {e}\n{traceback.format_exc()}")
+                for message in messages:
+                    self.in_hand.pop(message.id, None)
+            finally:
+                for _ in messages:
+                    self.bot.message_queue.task_done()
+
+    async def drain(self, timeout):
+        """Give queued and in-flight messages until the timeout to finish, then stop the
+        workers and return every mention that has not been answered."""
+        try:
+            await asyncio.wait_for(self.bot.message_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Drain timed out after {timeout}s with {self.bot.message_queue.qsize()} queued and {len(self.in_hand)} in flight")
+        workers, self.workers = self.workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        unanswered = list(self.in_hand.values())
+        self.in_hand.clear()
+        while not self.bot.message_queue.empty():
+            unanswered.append(self.bot.message_queue.get_nowait())
+            self.bot.message_queue.task_done()
+        unanswered.extend(self.held)
+        self.held = []
+        return unanswered
+
+    async def restore(self, entries, freshness):
+        """Re-fetch and queue mentions left unanswered by the previous shutdown.
+
+        Entries are removed from the list only once they have been queued or skipped,
+        so whatever is left if this is cancelled can be saved again.
+        """
+        now = time.time()
+        total = len(entries)
+        restored = 0
+        while entries:
+            entry = entries[0]
+            try:
+                if now - entry["created_at"] <= freshness:
+                    channel = self.bot.get_channel(entry["channel_id"]) or await self.bot.fetch_channel(entry["channel_id"])
+                    message = await channel.fetch_message(entry["message_id"])
+                    self.enqueued_at[message.id] = time.monotonic()
+                    await self.bot.message_queue.put(message)
+                    restored += 1
+            except (discord.HTTPException, discord.InvalidData) as e:
+                logging.warning(f"Could not re-fetch message {entry.get('message_id')}: {e}")
+            except (KeyError, TypeError) as e:
+                logging.warning(f"Skipping malformed pending message entry {entry!r}: {e}")
+            entries.pop(0)
+        logging.info(f"Re-queued {restored} of {total} messages left over from the last shutdown")
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -68,6 +131,7 @@ class MessageHandler(commands.Cog):
         retry_after = bucket.update_rate_limit()
         if retry_after:
             logging.info(f"Rate limited user {message.author.id} for {retry_after:.2f} seconds")
+            MESSAGES_SHED.inc("rate_limit")
             return
         if self.bot.react_user_id is not None and message.author.id == self.bot.react_user_id:
             try:
@@ -77,207 +141,224 @@ class MessageHandler(commands.Cog):
             except discord.HTTPException:
                 logging.error(f"Error reacting to message {message.id}")
         if self.bot.user in message.mentions:
+            refusal = self.bot.usage.check(message.author.id, message.guild.id if message.guild else None)
+            if refusal:
+                logging.info(f"User {message.author.id} is over their token budget")
+                MESSAGES_SHED.inc("budget")
+                try:
+                    await message.reply(refusal)
+                except discord.HTTPException:
+                    pass
+                return
+            if self.bot.draining:
+                self.held.append(message)
+                return
+            self.enqueued_at[message.id] = time.monotonic()
+            MESSAGES_RECEIVED.inc()
             await self.bot.message_queue.put(message)
 
     async def handle_messages(self, messages):
         for message in messages:
-            logging.info(f"Handling message {message.id} from user {message.author.id}")
+            enqueued_at = self.enqueued_at.pop(message.id, None)
+            if enqueued_at is not None:
+                STAGE_SECONDS.observe(time.monotonic() - enqueued_at, "queue_wait")
+            recording = self.bot.trace_recorder.message(enqueued_at) if self.bot.trace_recorder else nullcontext()
+            charging = usage.charge(self.bot.usage, message.author.id, message.guild.id if message.guild else None)
+            MESSAGES_IN_FLIGHT.inc()
+            try:
+                with recording, charging, STAGE_SECONDS.time("handle_message"):
+                    await self.handle_message(message)
+            finally:
+                MESSAGES_IN_FLIGHT.dec()
+            self.in_hand.pop(message.id, None)
 
-            # Check if bot has permissions in the channel
-            if not message.channel.permissions_for(message.guild.me).send_messages:
-                logging.warning(f"Bot lacks 'Send Messages' permission in channel {message.channel.id}")
-                try:
-                    await message.author.send("I don't have permission to respond in that channel. Please check my permissions or contact the server admin.")
-                except discord.Forbidden:
-                    logging.warning(f"Cannot DM user {message.author.id}")
-                continue
+    async def handle_message(self, message):
+        logging.info(f"Handling message {message.id} from user {message.author.id}")
 
-            raw_content = message.content
-            question = raw_content
+        # Check if bot has permissions in the channel
+        if not message.channel.permissions_for(message.guild.me).send_messages:
+            logging.warning(f"Bot lacks 'Send Messages' permission in channel {message.channel.id}")
+            try:
+                await message.author.send("I don't have permission to respond in that channel. Please check my permissions or contact the server admin.")
+            except discord.Forbidden:
+                logging.warning(f"Cannot DM user {message.author.id}")
+            return
 
-            if self._re_bot_mention is None and self.bot.user:
-                self._re_bot_mention = re.compile(f"<@!?{self.bot.user.id}>")
-            if self._re_bot_name is None and self.bot.user and self.bot.user.name:
-                self._re_bot_name = re.compile(f"@{re.escape(self.bot.user.name.lower())}", re.IGNORECASE)
-            bot_member = message.guild.get_member(self.bot.user.id) if message.guild else None
-            bot_nick = bot_member.nick.lower() if bot_member and bot_member.nick else None
-            if self._re_bot_nick is None and bot_nick:
-                self._re_bot_nick = re.compile(f"@{re.escape(bot_nick)}", re.IGNORECASE)
+        raw_content = message.content
+        question = raw_content
 
-            if self._re_bot_mention:
-                question = self._re_bot_mention.sub("", question).strip()
-            if self._re_bot_name:
-                question = self._re_bot_name.sub("", question).strip()
-            if self._re_bot_nick:
-                question = self._re_bot_nick.sub("", question).strip()
+        if self._re_bot_mention is None and self.bot.user:
+            self._re_bot_mention = re.compile(f"<@!?{self.bot.user.id}>")
+        if self._re_bot_name is None and self.bot.user and self.bot.user.name:
+            self._re_bot_name = re.compile(f"@{re.escape(self.bot.user.name.lower())}", re.IGNORECASE)
+        bot_member = message.guild.get_member(self.bot.user.id) if message.guild else None
+        bot_nick = bot_member.nick.lower() if bot_member and bot_member.nick else None
+        if self._re_bot_nick is None and bot_nick:
+            self._re_bot_nick = re.compile(f"@{re.escape(bot_nick)}", re.IGNORECASE)
 
-            for user in message.mentions:
-                if user != self.bot.user:
-                    if user.id not in self._re_user_mention:
-                        self._re_user_mention[user.id] = re.compile(f"<@!?{user.id}>")
-                    display_name = user.display_name if message.guild and message.guild.get_member(user.id) else user.name
-                    question = self._re_user_mention[user.id].sub(display_name, question).strip()
+        if self._re_bot_mention:
+            question = self._re_bot_mention.sub("", question).strip()
+        if self._re_bot_name:
+            question = self._re_bot_name.sub("", question).strip()
+        if self._re_bot_nick:
+            question = self._re_bot_nick.sub("", question).strip()
 
-            if not question:
-                await message.reply(f"Please ask a question or use slash commands.")
-                continue
+        for user in message.mentions:
+            if user != self.bot.user:
+                if user.id not in self._re_user_mention:
+                    self._re_user_mention[user.id] = re.compile(f"<@!?{user.id}>")
+                display_name = user.display_name if message.guild and message.guild.get_member(user.id) else user.name
+                question = self._re_user_mention[user.id].sub(display_name, question).strip()
 
-            reply_chain = []
+        if not question:
+            await message.reply(f"Please ask a question or use slash commands.")
+            return
+
+        chain_start = time.perf_counter()
+        reply_chain = []
+        current_message = message
+        max_chain_length = 5
+        try:
+            for _ in range(max_chain_length):
+                if not current_message.reference:
+                    break
+                current_message = await current_message.channel.fetch_message(current_message.reference.message_id)
+                if current_message:
+                    author_name = current_message.author.display_name if message.guild and message.guild.get_member(current_message.author.id) else current_message.author.name
+                    content = current_message.content if current_message.content else "<no text content>"
+                    reply_chain.append(f"{author_name}: {content}")
+                else:
+                    break
+            reply_chain.reverse()
+        except (discord.NotFound, discord.Forbidden) as e:
+            logging.warning(f"Could not fetch reply chain for message {message.id}: {str(e)}")
+
+        image_urls = []
+        for attachment in message.attachments:
+            if attachment.content_type and attachment.content_type.startswith("image/"):
+                image_urls.append(attachment.url)
+        if not image_urls and reply_chain:
             current_message = message
-            max_chain_length = 5
-            try:
-                for _ in range(max_chain_length):
-                    if not current_message.reference:
-                        break
+            while current_message.reference:
+                found_image = False
+                try:
                     current_message = await current_message.channel.fetch_message(current_message.reference.message_id)
-                    if current_message:
-                        author_name = current_message.author.display_name if message.guild and message.guild.get_member(current_message.author.id) else current_message.author.name
-                        content = current_message.content if current_message.content else "<no text content>"
-                        reply_chain.append(f"{author_name}: {content}")
-                    else:
+                    for attachment in current_message.attachments:
+                        if attachment.content_type and attachment.content_type.startswith("image/"):
+                            image_urls.append(attachment.url)
+                            found_image = True
+                    if found_image:
                         break
-                reply_chain.reverse()
-            except (discord.NotFound, discord.Forbidden) as e:
-                logging.warning(f"Could not fetch reply chain for message {message.id}: {str(e)}")
+                except (discord.NotFound, discord.Forbidden):
+                    break
+        STAGE_SECONDS.observe(time.perf_counter() - chain_start, "reply_chain")
+        tracing.note(depth=len(reply_chain), images=len(image_urls), fetch=round(time.perf_counter() - chain_start, 3))
 
-            image_urls = []
-            for attachment in message.attachments:
-                if attachment.content_type and attachment.content_type.startswith("image/"):
-                    image_urls.append(attachment.url)
-            if not image_urls and reply_chain:
-                current_message = message
-                while current_message.reference:
-                    found_image = False
-                    try:
-                        current_message = await current_message.channel.fetch_message(current_message.reference.message_id)
-                        for attachment in current_message.attachments:
-                            if attachment.content_type and attachment.content_type.startswith("image/"):
-                                image_urls.append(attachment.url)
-                                found_image = True
-                        if found_image:
-                            break
-                    except (discord.NotFound, discord.Forbidden):
-                        break
-
-            context = f"Conversation history:\n" + "\n".join(reply_chain) + f"\nCurrent question from {message.author.display_name}: {question}" if reply_chain else question
+        context = f"Conversation history:\n" + "\n".join(reply_chain) + f"\nCurrent question from {message.author.display_name}: {question}" if reply_chain else question
 
-            mentions = [f"<@!{user.id}>" for user in message.mentions if user != self.bot.user]
-            mention_text = " ".join(mentions) + " " if mentions else ""
+        mentions = [f"<@!{user.id}>" for user in message.mentions if user != self.bot.user]
+        mention_text = " ".join(mentions) + " " if mentions else ""
 
-            logging.info(f"Context sent to API for message {message.id}: {context}")
+        logging.info(f"Context sent to API for message {message.id}: {context}")
 
-            selected_api = self.bot.user_api_selection.get(message.author.id, "openai")
-            logging.info(f"Selected API for message {message.id}: {selected_api}")
+        selected_api = self.bot.user_api_selection.get(message.author.id, "openai")
+        tracing.note(api=selected_api, ctx=len(context))
+        logging.info(f"Selected API for message {message.id}: {selected_api}")
 
-            current_time = datetime.datetime.now()
-            offset_str = current_time.strftime("%z")
-            offset_hours = offset_str[:3] if offset_str else "+00"
-            formatted_time = current_time.strftime(f"%I:%M %p {offset_hours} on %A, %B %d, %Y")
+        current_time = datetime.datetime.now()
+        offset_str = current_time.strftime("%z")
+        offset_hours = offset_str[:3] if offset_str else "+00"
+        formatted_time = current_time.strftime(f"%I:%M %p {offset_hours} on %A, %B %d, %Y")
 
-            if selected_api == "xai":
-                if not self.bot.XAI_API_KEY:
-                    await message.reply(f"Sorry, the xAI API is not configured.")
-                    continue
-                if image_urls:
-                    await message.reply(f"Sorry, image input is only supported with OpenAI at the moment.")
-                    continue
-                api_url = self.bot.XAI_CHAT_URL
-                api_key = self.bot.XAI_API_KEY
-                model = self.bot.XAI_MODEL
-                headers = {
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                    "User-Agent": "DiscordBot/1.0"
-                }
-            else:
-                if not self.bot.OPENAI_API_KEY:
-                    await message.reply(f"Sorry, the OpenAI API is not configured.")
-                    continue
-                api_url = self.bot.OPENAI_CHAT_URL
-                api_key = self.bot.OPENAI_API_KEY
-                model = self.bot.OPENAI_MODEL
-                headers = {
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                    "User-Agent": "DiscordBot/1.0"
-                }
+        provider = self.bot.providers.get(selected_api, self.bot.providers["openai"])
+        if not provider.configured:
+            await message.reply(f"Sorry, the {provider.label} API is not configured.")
+            return
+        if provider.name == "xai" and image_urls:
+            await message.reply(f"Sorry, image input is only supported with OpenAI at the moment.")
+            return
+        model = provider.model
 
-            async with message.channel.typing():
-                try:
-                    session = self.bot.session
-                    if selected_api == "openai" and image_urls:
-                        content_list = [{"type": "text", "text": context}]
-                        for url in image_urls:
-                            content_list.append({"type": "image_url", "image_url": {"url": url}})
-                        messages = [
-                            {"role": "system", "content": f"Today's date and time is {formatted_time}."},
-                            {"role": "user", "content": content_list}
-                        ]
-                        payload = {
-                            "model": model,
-                            "messages": messages,
-                            "max_tokens": self.bot.MAX_TOKENS
-                        }
-                        response_data = await send_api_request(session, api_url, headers, payload, self.bot.API_TIMEOUT)
-                        if "choices" in response_data and response_data["choices"]:
-                            answer = response_data["choices"][0]["message"]["content"]
-                        else:
-                            answer = "Invalid response from API"
+        async with message.channel.typing():
+            try:
+                if provider.name == "openai" and image_urls:
+                    content_list = [{"type": "text", "text": context}]
+                    for url in image_urls:
+                        content_list.append({"type": "image_url", "image_url": {"url": url}})
+                    messages = [
+                        {"role": "system", "content": f"Today's date and time is {formatted_time}."},
+                        {"role": "user", "content": content_list}
+                    ]
+                    payload = {
+                        "model": model,
+                        "messages": messages,
+                        "max_tokens": self.bot.MAX_TOKENS
+                    }
+                    response_data = await provider.chat(payload)
+                    if "choices" in response_data and response_data["choices"]:
+                        answer = response_data["choices"][0]["message"]["content"]
                     else:
-                        messages = [
-                            {"role": "system", "content": f"Today's date and time is {formatted_time}."},
-                            {"role": "user", "content": context}
-                        ]
-                        max_iterations = 5
-                        for iteration in range(max_iterations):
-                            payload = {
-                                "model": model,
-                                "messages": messages,
-                                "tools": tool_definitions,
-                                "tool_choice": "auto",
-                                "stream": False,
-                                "max_tokens": self.bot.MAX_TOKENS
-                            }
-                            response_data = await send_api_request(session, api_url, headers, payload, self.bot.API_TIMEOUT)
-                            if "choices" not in response_data or not response_data["choices"]:
-                                answer = "Invalid response from API"
-                                break
-                            response_message = response_data["choices"][0]["message"]
-                            if "tool_calls" not in response_message or not response_message["tool_calls"]:
-                                answer = response_message["content"]
-                                break
-                            else:
-                                messages.append(response_message)
-                                for tool_call in response_message["tool_calls"]:
-                                    function_name = tool_call["function"]["name"]
-                                    arguments = json.loads(tool_call["function"]["arguments"])
-                                    if function_name in tools_map:
-                                        result = await tools_map[function_name](**arguments)
-                                        messages.append({
-                                            "role": "tool",
-                                            "content": str(result),
-                                            "tool_call_id": tool_call["id"]
-                                        })
-                                    else:
-                                        messages.append({
-                                            "role": "tool",
-                                            "content": "Tool not found",
-                                            "tool_call_id": tool_call["id"]
-                                        })
+                        answer = "Invalid response from API"
+                else:
+                    # Encoded once; each tool iteration only encodes and hashes the new messages
+                    payload = PayloadEncoder({
+                        "model": model,
+                        "tools": tool_definitions,
+                        "tool_choice": "auto",
+                        "stream": False,
+                        "max_tokens": self.bot.MAX_TOKENS
+                    }, [
+                        {"role": "system", "content": f"Today's date and time is {formatted_time}."},
+                        {"role": "user", "content": context}
+                    ])
+                    max_iterations = 5
+                    for iteration in range(max_iterations):
+                        response_data = await provider.chat(payload)
+                        if "choices" not in response_data or not response_data["choices"]:
+                            answer = "Invalid response from API"
+                            break
+                        response_message = response_data["choices"][0]["message"]
+                        if "tool_calls" not in response_message or not response_message["tool_calls"]:
+                            answer = response_message["content"]
+                            break
                         else:
-                            answer = "Maximum iterations reached without a final answer."
+                            payload.append(response_message)
+                            for tool_call in response_message["tool_calls"]:
+                                function_name = tool_call["function"]["name"]
+                                arguments = loads(tool_call["function"]["arguments"])
+                                if function_name in tools_map:
+                                    result = await tools_map[function_name](**arguments)
+                                    payload.append({
+                                        "role": "tool",
+                                        "content": str(result),
+                                        "tool_call_id": tool_call["id"]
+                                    })
+                                else:
+                                    payload.append({
+                                        "role": "tool",
+                                        "content": "Tool not found",
+                                        "tool_call_id": tool_call["id"]
+                                    })
+                    else:
+                        answer = "Maximum iterations reached without a final answer."
 
-                    answer += f"\n(answered by {'xAI' if selected_api == 'xai' else 'OpenAI'})"
-                    max_length = 2000 - len(mention_text)
-                    chunks = split_message(answer, max_length)
-                    for i, chunk in enumerate(chunks):
-                        final_message = f"{mention_text}{chunk}" if i == 0 else chunk
-                        if final_message.strip():
-                            await message.reply(final_message)
-                            await asyncio.sleep(0.5)
-                except Exception as e:
-                    logging.error(f"Unexpected error ({selected_api}) for message {message.id}: {str(e)}\n{traceback.format_exc()}")
-                    await message.reply(f"Unexpected error from {selected_api.upper()}: {str(e)}")
+                answer += f"\n(answered by {provider.label})"
+                max_length = 2000 - len(mention_text)
+                chunks = split_message(answer, max_length)
+                # Only the replies themselves are timed, not the pause between chunks
+                send_seconds = 0.0
+                for i, chunk in enumerate(chunks):
+                    final_message = f"{mention_text}{chunk}" if i == 0 else chunk
+                    if final_message.strip():
+                        send_start = time.perf_counter()
+                        await message.reply(final_message)
+                        send_seconds += time.perf_counter() - send_start
+                        await asyncio.sleep(0.5)
+                STAGE_SECONDS.observe(send_seconds, "discord_send")
+                tracing.note(out=len(answer), chunks=len(chunks), send=round(send_seconds, 3))
+            except Exception as e:
+                logging.error(f"Unexpected error ({selected_api}) for message {message.id}: {str(e)}\n{traceback.format_exc()}")
+                await message.reply(f"Unexpected error from {selected_api.upper()}: {str(e)}")
 
 async def setup(bot):
     await bot.add_cog(MessageHandler(bot))
\ No newline at end of file
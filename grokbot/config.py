@@ -9,6 +9,14 @@ MAX_TOKENS = int(os.getenv("MAX_TOKENS", 5000))
 WORKER_COUNT = int(os.getenv("WORKER_COUNT", 5))
 BOT_OWNER_ID = int(os.getenv("BOT_OWNER_ID", 248083498433380352))
 API_TIMEOUT = int(os.getenv("API_TIMEOUT", 60))
+API_CONNECT_TIMEOUT = int(os.getenv("API_CONNECT_TIMEOUT", 10))
+API_RETRIES = int(os.getenv("API_RETRIES", 3))
+
+# Connection pool tuning, applied per provider (each talks to a single host)
+PROVIDER_POOL_SIZE = int(os.getenv("PROVIDER_POOL_SIZE", 20))
+PROVIDER_KEEPALIVE = int(os.getenv("PROVIDER_KEEPALIVE", 60))  # seconds an idle connection is kept open
+PROVIDER_DNS_TTL = int(os.getenv("PROVIDER_DNS_TTL", 300))  # seconds a resolved address is reused
+USER_AGENT = "GrokBot/1.0"
 
 XAI_API_KEY = os.getenv("XAI_API_KEY")
 XAI_MODEL = os.getenv("XAI_MODEL", "grok-3-mini")
@@ -18,18 +26,48 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
 OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
 OPENAI_VOICE_URL = "https://api.openai.com/v1/audio/speech"
+OPENAI_TTS_MODEL = os.getenv("OPENAI_TTS_MODEL", "gpt-4o-mini-tts")
+
+MAX_AUDIO_BYTES = 8 * 1024 * 1024  # Discord attachment limit
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", "/app/tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+# Prometheus-format metrics endpoint; set METRICS_PORT=0 to disable
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+
+# Event loop lag monitor: wake up every interval and report wakeups later than the threshold
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 0.25))
 
-USER_PREF_FILE = Path("/app/user_prefs/user_preferences.json")
+# Opt-in anonymized traffic traces for benchmarks/replay.py; unset to disable
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_FLUSH_INTERVAL = int(os.getenv("TRACE_FLUSH_INTERVAL", 10))
+
+USER_PREF_FILE = Path(os.getenv("USER_PREF_FILE", "/app/user_prefs/user_preferences.json"))
+
+# Rolling token budgets per user and per guild; 0 means unlimited
+USER_TOKEN_BUDGET = int(os.getenv("USER_TOKEN_BUDGET", 0))
+GUILD_TOKEN_BUDGET = int(os.getenv("GUILD_TOKEN_BUDGET", 0))
+TOKEN_BUDGET_WINDOW = int(os.getenv("TOKEN_BUDGET_WINDOW", 3600))  # seconds
+USAGE_FILE = Path(os.getenv("USAGE_FILE", "/app/user_prefs/usage.json"))
 USER_PREF_WRITE_INTERVAL = 30  # Increased to 30 seconds
 
+# Graceful shutdown: how long queued and in-flight mentions get to finish, and how
+# old an unanswered mention may be before it is dropped instead of re-queued on start
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 20))
+QUEUE_FRESHNESS = int(os.getenv("QUEUE_FRESHNESS", 600))
+PENDING_QUEUE_FILE = Path(os.getenv("PENDING_QUEUE_FILE", "/app/user_prefs/pending_messages.json"))
+
 # Logging setup
 root_logger = logging.getLogger()
 root_logger.setLevel(logging.INFO)
 for handler in root_logger.handlers[:]:
     root_logger.removeHandler(handler)
-log_dir = Path('/app/logs')
+log_dir = Path(os.getenv("LOG_DIR", "/app/logs"))
 log_dir.mkdir(parents=True, exist_ok=True)
-file_handler = logging.FileHandler(log_dir / 'bot.log')
+LOG_FILE = log_dir / 'bot.log'
+file_handler = logging.FileHandler(LOG_FILE)
 console_handler = logging.StreamHandler(sys.stdout)
 formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
 file_handler.setFormatter(formatter)
@@ -0,0 +1,196 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}
+        if not self.label_names:
+            self.values[()] = 0
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield self.name, labels, None, value
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.function = None
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set_function(self, function):
+        """Read the value from function() at collection time instead of storing it."""
+        self.function = function
+
+    def get(self, *labels):
+        if self.function is not None:
+            return self.function()
+        return super().get(*labels)
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, (), None, self.function()
+            return
+        for labels, value in sorted(self.values.items()):
+            yield self.name, labels, None, value
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [bucket counts..., +Inf count], sum
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def count(self, *labels):
+        entry = self.values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def quantile(self, q, *labels):
+        """Estimate a quantile by linear interpolation within the bucket that contains it."""
+        entry = self.values.get(labels)
+        if not entry:
+            return None
+        counts = entry[0]
+        target = q * sum(counts)
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if count and cumulative + count >= target:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (target - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield self.name + "_bucket", labels, ("le", _format_value(float(bound))), cumulative
+            yield self.name + "_sum", labels, None, total
+            yield self.name + "_count", labels, None, cumulative
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.label_names, labels, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram("grokbot_stage_seconds", "Latency of each message handling stage in seconds", labels=("stage",)))
+MESSAGES_RECEIVED = REGISTRY.register(Counter("grokbot_messages_received_total", "Mentions accepted into the message queue"))
+MESSAGES_SHED = REGISTRY.register(Counter("grokbot_messages_shed_total", "Messages dropped before reaching the queue", labels=("reason",)))
+API_REQUESTS = REGISTRY.register(Counter("grokbot_api_requests_total", "Upstream API attempts", labels=("kind",)))
+API_RETRIES = REGISTRY.register(Counter("grokbot_api_retries_total", "Upstream API attempts that were retried", labels=("reason",)))
+API_ERRORS = REGISTRY.register(Counter("grokbot_api_errors_total", "Upstream API calls that failed after retries"))
+API_RATE_LIMITED = REGISTRY.register(Counter("grokbot_api_rate_limited_total", "HTTP 429 responses from upstream APIs"))
+CACHE_HITS = REGISTRY.register(Counter("grokbot_cache_hits_total", "Cache hits", labels=("cache",)))
+CACHE_MISSES = REGISTRY.register(Counter("grokbot_cache_misses_total", "Cache misses", labels=("cache",)))
+QUEUE_DEPTH = REGISTRY.register(Gauge("grokbot_queue_depth", "Messages waiting in the message queue"))
+WORKERS = REGISTRY.register(Gauge("grokbot_workers", "Running message worker tasks"))
+MESSAGES_IN_FLIGHT = REGISTRY.register(Gauge("grokbot_messages_in_flight", "Messages currently being handled"))
+API_IN_FLIGHT = REGISTRY.register(Gauge("grokbot_api_requests_in_flight", "Upstream API requests currently open"))
+LOOP_LAG = REGISTRY.register(Histogram("grokbot_event_loop_lag_seconds", "How late the event loop ran a periodic wakeup"))
+LOOP_STALLS = REGISTRY.register(Counter("grokbot_event_loop_stalls_total", "Event loop wakeups later than LOOP_LAG_THRESHOLD"))
+
+async def start_metrics_server(host, port):
+    async def handle_metrics(request):
+        return web.Response(body=REGISTRY.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
+
+def format_stats():
+    """Human-readable summary of the metrics above, for the /stats command."""
+    shed = ", ".join(f"{labels[0]} {value}" for labels, value in sorted(MESSAGES_SHED.values.items())) or "none"
+    lines = [
+        f"Queue depth: {QUEUE_DEPTH.get()} | Workers: {WORKERS.get()} | In flight: {MESSAGES_IN_FLIGHT.get()} messages, {API_IN_FLIGHT.get()} API requests",
+        f"Messages: {MESSAGES_RECEIVED.get()} received, shed: {shed}",
+        f"API: {sum(API_REQUESTS.values.values())} attempts, {sum(API_RETRIES.values.values())} retries, "
+        f"{API_RATE_LIMITED.get()} rate limited (429), {API_ERRORS.get()} failed",
+        f"Event loop: {LOOP_STALLS.get()} stalls, lag p99 {LOOP_LAG.quantile(0.99) or 0:.3f}s",
+    ]
+    for cache in ("api", "tts"):
+        hits, misses = CACHE_HITS.get(cache), CACHE_MISSES.get(cache)
+        rate = f"{hits / (hits + misses):.0%}" if hits + misses else "n/a"
+        lines.append(f"{cache.upper()} cache: {rate} hit rate ({hits} hits, {misses} misses)")
+    lines.append("")
+    lines.append(f"{'stage':<16}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for (stage,) in sorted(STAGE_SECONDS.values):
+        quantiles = [STAGE_SECONDS.quantile(q, stage) for q in (0.5, 0.95, 0.99)]
+        lines.append(f"{stage:<16}{STAGE_SECONDS.count(stage):>7}" + "".join(f"{q:>8.3f}s" for q in quantiles))
+    return "\n".join(lines)
@@ -0,0 +1,125 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from grokbot.metrics import LOOP_LAG, LOOP_STALLS
+
+class LoopLagMonitor:
+    """Measures event loop lag and logs what the loop thread was running when it stalls.
+
+    A task on the loop records how late each periodic wakeup is. A watchdog
+    thread checks that those wakeups keep happening and, if one is overdue,
+    logs the loop thread's current stack so the blocking code can be found.
+    """
+
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_beat = time.monotonic()
+        self.loop_thread_id = None
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.stopped.clear()
+        self.last_beat = time.monotonic()
+        self.task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self.thread = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self.thread.start()
+        logging.info(f"Event loop lag monitor started (interval {self.interval}s, threshold {self.threshold}s)")
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last_beat = time.monotonic()
+            LOOP_LAG.observe(lag)
+            if lag > self.threshold:
+                LOOP_STALLS.inc()
+                logging.warning(f"Event loop lagged {lag:.3f}s behind schedule")
+
+    def _watch(self):
+        reported_beat = None
+        while not self.stopped.wait(self.interval):
+            last_beat = self.last_beat
+            overdue = time.monotonic() - last_beat - self.interval
+            # Only capture one stack per stall
+            if overdue > self.threshold and last_beat != reported_beat:
+                reported_beat = last_beat
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else "<loop thread not found>\n"
+                logging.warning(f"Event loop blocked for {overdue:.3f}s so far, loop thread stack:\n{stack}")
+
+async def profile_cpu(duration, limit=50):
+    """Profile the event loop thread for duration seconds and return the top entries as text."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        profiler.disable()
+    def render():
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        stream.write("\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(limit)
+        return stream.getvalue()
+    return await asyncio.to_thread(render)
+
+async def snapshot_memory(duration, limit=50):
+    """Trace allocations for duration seconds and return the top entries as text.
+
+    If tracemalloc was already tracing, the report lists what grew during the
+    window instead of everything allocated since that trace began.
+    """
+    started = not tracemalloc.is_tracing()
+    baseline = None
+    if started:
+        tracemalloc.start(10)
+    else:
+        baseline = await asyncio.to_thread(tracemalloc.take_snapshot)
+    try:
+        await asyncio.sleep(duration)
+        snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+    def render():
+        filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+        snapshot_filtered = snapshot.filter_traces(filters)
+        lines = [f"Traced memory: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB", ""]
+        if baseline is not None:
+            lines.append(f"tracemalloc was already running; largest changes over the last {duration} seconds:")
+            stats = snapshot_filtered.compare_to(baseline.filter_traces(filters), "lineno")
+        else:
+            stats = snapshot_filtered.statistics("lineno")
+        for i, stat in enumerate(stats[:limit], 1):
+            lines.append(f"{i}. {stat}")
+        lines.append("")
+        lines.append("Top allocation tracebacks:")
+        for stat in snapshot_filtered.statistics("traceback")[:5]:
+            lines.append(f"{stat.count} blocks, {stat.size / 1024:.1f} KiB")
+            lines.extend(f"    {line}" for line in stat.traceback.format())
+        return "\n".join(lines)
+    return await asyncio.to_thread(render)
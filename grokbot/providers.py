@@ -0,0 +1,69 @@
+import aiohttp
+import logging
+from types import MappingProxyType
+from grokbot.api import send_api_request, send_speech_request
+from grokbot.config import (
+    API_TIMEOUT, API_CONNECT_TIMEOUT, PROVIDER_POOL_SIZE,
+    PROVIDER_KEEPALIVE, PROVIDER_DNS_TTL, USER_AGENT
+)
+
+class ProviderClient:
+    """Connection pool, headers and timeout policy for a single AI provider."""
+
+    def __init__(self, name, label, api_key, model, chat_url, speech_url=None, api_timeout=API_TIMEOUT):
+        self.name = name
+        self.label = label
+        self.api_key = api_key
+        self.model = model
+        self.chat_url = chat_url
+        self.speech_url = speech_url
+        self.headers = MappingProxyType({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "User-Agent": USER_AGENT
+        })
+        self.timeout = aiohttp.ClientTimeout(total=api_timeout, connect=API_CONNECT_TIMEOUT)
+        self.session = None
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    def get_session(self):
+        # Sessions are owned here and recreated on demand, so callers never hold a stale one
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=PROVIDER_POOL_SIZE,
+                limit_per_host=PROVIDER_POOL_SIZE,
+                keepalive_timeout=PROVIDER_KEEPALIVE,
+                use_dns_cache=True,
+                ttl_dns_cache=PROVIDER_DNS_TTL,
+                enable_cleanup_closed=True
+            )
+            self.session = aiohttp.ClientSession(connector=connector, headers=self.headers, timeout=self.timeout)
+            logging.info(f"Created aiohttp ClientSession for {self.label}")
+        return self.session
+
+    async def chat(self, payload):
+        return await send_api_request(self.get_session(), self.chat_url, None, payload, self.timeout)
+
+    async def speech(self, payload, max_bytes):
+        if self.speech_url is None:
+            raise RuntimeError(f"{self.label} does not provide a speech endpoint")
+        return await send_speech_request(self.get_session(), self.speech_url, None, payload, self.timeout, max_bytes)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            try:
+                await self.session.close()
+                logging.info(f"Closed aiohttp ClientSession for {self.label}")
+            except Exception as e:
+                logging.error(f"Failed to close aiohttp session for {self.label}: {str(e)}")
+        self.session = None
+
+def build_providers(bot):
+    return {
+        "xai": ProviderClient("xai", "xAI", bot.XAI_API_KEY, bot.XAI_MODEL, bot.XAI_CHAT_URL, api_timeout=bot.API_TIMEOUT),
+        "openai": ProviderClient("openai", "OpenAI", bot.OPENAI_API_KEY, bot.OPENAI_MODEL, bot.OPENAI_CHAT_URL,
+                                 speech_url=bot.OPENAI_VOICE_URL, api_timeout=bot.API_TIMEOUT),
+    }
@@ -0,0 +1,61 @@
+import hashlib
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj):
+    """Encode obj as compact JSON bytes with sorted keys."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class PayloadEncoder:
+    """A chat payload encoded once and shared by the cache key and the request body.
+
+    Messages are encoded as they are appended and fed into a running hash, so a
+    tool loop that keeps appending to the conversation only pays for the new
+    messages on each iteration.
+    """
+
+    def __init__(self, params, messages=()):
+        self.params = params
+        self._params_bytes = dumps(params)
+        self._messages = []
+        self._hasher = hashlib.sha256()
+        for message in messages:
+            self.append(message)
+
+    @classmethod
+    def from_payload(cls, payload):
+        params = {k: v for k, v in payload.items() if k != "messages"}
+        return cls(params, payload.get("messages", ()))
+
+    def append(self, message):
+        encoded = dumps(message)
+        # Length-prefix each message so different splits can never hash the same
+        self._hasher.update(len(encoded).to_bytes(8, "big"))
+        self._hasher.update(encoded)
+        self._messages.append(encoded)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def cache_key(self):
+        hasher = self._hasher.copy()
+        hasher.update(b"\0")
+        hasher.update(self._params_bytes)
+        return hasher.hexdigest()
+
+    def body(self):
+        messages = b'"messages":[' + b",".join(self._messages) + b"]"
+        if self._params_bytes == b"{}":
+            return b"{" + messages + b"}"
+        return self._params_bytes[:-1] + b"," + messages + b"}"
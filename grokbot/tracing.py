@@ -0,0 +1,87 @@
+import asyncio
+import contextvars
+import gzip
+import logging
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from grokbot.serialization import dumps, loads
+
+# The trace record of the message being handled by the current task, if recording
+_current = contextvars.ContextVar("grokbot_trace", default=None)
+
+def note(**fields):
+    record = _current.get()
+    if record is not None:
+        record.update(fields)
+
+def append(key, item):
+    record = _current.get()
+    if record is not None:
+        record.setdefault(key, []).append(item)
+
+class TraceRecorder:
+    """Writes anonymized per-message traces for offline replay.
+
+    Each record holds only shapes and timings: the recording session (the
+    wall-clock time this recorder started) and the arrival offset within it, queue wait,
+    reply chain depth, context size, image count, every upstream call's
+    latency, payload sizes and tool-call count, web search latencies and the
+    answer size. No message content, names or IDs are written. Records are
+    buffered and appended to a gzip-compressed JSON lines file.
+    """
+
+    def __init__(self, path, flush_interval):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.started_at = time.monotonic()
+        # Offsets restart at zero in every process appending to the file, so records carry their session
+        self.session = round(time.time(), 3)
+        self.buffer = []
+        self.task = None
+
+    @contextmanager
+    def message(self, enqueued_at):
+        arrived = enqueued_at if enqueued_at is not None else time.monotonic()
+        record = {"s": self.session, "t": round(arrived - self.started_at, 3), "wait": round(time.monotonic() - arrived, 3)}
+        token = _current.set(record)
+        start = time.monotonic()
+        try:
+            yield record
+        finally:
+            _current.reset(token)
+            record["total"] = round(time.monotonic() - start, 3)
+            self.buffer.append(dumps(record) + b"\n")
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.flush_periodically())
+        logging.info(f"Recording message traces to {self.path}")
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        lines, self.buffer = self.buffer, []
+        def write():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Each flush appends a gzip member; gzip.open reads them back as one stream
+            with gzip.open(self.path, "ab") as f:
+                f.write(b"".join(lines))
+        try:
+            await asyncio.to_thread(write)
+        except Exception as e:
+            logging.error(f"Failed to write message traces: {str(e)}")
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+def read_traces(path):
+    with gzip.open(path, "rb") as f:
+        return [loads(line) for line in f if line.strip()]
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+import aiofiles
+from grokbot.metrics import CACHE_HITS, CACHE_MISSES
+
+class TTSCache:
+    """Disk-backed LRU cache of generated speech, bounded by total size on disk."""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self.total_bytes = 0
+        self.lock = asyncio.Lock()
+        self.in_flight = {}  # key -> future of audio being generated for it
+
+    @staticmethod
+    def make_key(text, voice, model):
+        return hashlib.sha256(json.dumps([model, voice, text]).encode()).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.mp3"
+
+    async def load(self):
+        """Rebuild the index from disk, using mtime as the last-access time."""
+        def scan():
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Partial writes left behind by a crash
+            for path in self.cache_dir.glob("*.tmp"):
+                path.unlink(missing_ok=True)
+            found = []
+            for path in self.cache_dir.glob("*.mp3"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, path.stem, stat.st_size))
+            found.sort()
+            return found
+        try:
+            found = await asyncio.to_thread(scan)
+        except Exception as e:
+            logging.error(f"Failed to load TTS cache from {self.cache_dir}: {str(e)}")
+            return
+        async with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            for _, key, size in found:
+                self.entries[key] = size
+                self.total_bytes += size
+            await self._evict()
+        logging.info(f"Loaded TTS cache with {len(self.entries)} entries ({self.total_bytes} bytes)")
+
+    async def get(self, key):
+        async with self.lock:
+            if key not in self.entries:
+                CACHE_MISSES.inc("tts")
+                return None
+            self.entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            async with aiofiles.open(path, 'rb') as f:
+                data = await f.read()
+            # Keep mtime in step with LRU order so it survives restarts
+            await asyncio.to_thread(os.utime, path)
+        except FileNotFoundError:
+            async with self.lock:
+                size = self.entries.pop(key, None)
+                if size is not None:
+                    self.total_bytes -= size
+            CACHE_MISSES.inc("tts")
+            return None
+        except Exception as e:
+            logging.error(f"Failed to read TTS cache entry {key}: {str(e)}")
+            return None
+        logging.info(f"TTS cache hit: {key}")
+        CACHE_HITS.inc("tts")
+        return data
+
+    async def put(self, key, data):
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        path = self._path(key)
+        # A unique temp name per writer so concurrent puts of one key never share a file
+        tmp_path = path.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                await f.write(data)
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        except Exception as e:
+            logging.error(f"Failed to write TTS cache entry {key}: {str(e)}")
+            await asyncio.to_thread(tmp_path.unlink, True)
+            return
+        async with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.total_bytes += size
+            await self._evict()
+
+    async def get_or_create(self, key, produce):
+        """Return cached audio for key, or await produce() to make it.
+
+        Concurrent requests for the same key share one produce() call.
+        """
+        data = await self.get(key)
+        if data is not None:
+            return data
+        pending = self.in_flight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        pending = asyncio.get_running_loop().create_future()
+        # Mark the outcome as retrieved even when no other request was waiting on it
+        pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.in_flight[key] = pending
+        try:
+            try:
+                data = await produce()
+            except asyncio.CancelledError:
+                pending.cancel()
+                raise
+            except Exception as e:
+                pending.set_exception(e)
+                raise
+            pending.set_result(data)
+            # Stay registered until the file is in place so late arrivals don't generate it again
+            await self.put(key, data)
+        finally:
+            del self.in_flight[key]
+        return data
+
+    async def _evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                await asyncio.to_thread(self._path(key).unlink, True)
+            except Exception as e:
+                logging.error(f"Failed to evict TTS cache entry {key}: {str(e)}")
@@ -0,0 +1,112 @@
+import contextvars
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# (tracker, user_id, guild_id) that upstream usage in the current task is charged to
+_scope = contextvars.ContextVar("grokbot_usage_scope", default=None)
+
+@contextmanager
+def charge(tracker, user_id, guild_id):
+    """Charge token usage of API calls made inside this block to a user and guild."""
+    token = _scope.set((tracker, user_id, guild_id))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+def record_response(response_data):
+    """Called for every response that actually came from upstream (not the cache)."""
+    scope = _scope.get()
+    if scope is None:
+        return
+    tracker, user_id, guild_id = scope
+    usage = response_data.get("usage") or {}
+    tokens = usage.get("total_tokens") or (usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+    if tokens:
+        tracker.record(user_id, guild_id, tokens)
+
+class UsageTracker:
+    """Rolling per-user and per-guild token usage, bucketed by minute, with budget checks."""
+
+    def __init__(self, window, user_budget, guild_budget, bucket_seconds=60):
+        self.window = window
+        self.user_budget = user_budget
+        self.guild_budget = guild_budget
+        self.bucket_seconds = bucket_seconds
+        self.usage = {"users": {}, "guilds": {}}  # scope -> id -> deque of [bucket start, tokens]
+        self.totals = {"users": {}, "guilds": {}}  # scope -> id -> tokens since tracking began
+        self.dirty = False
+
+    def _add(self, scope, key, tokens, now):
+        bucket_start = now - now % self.bucket_seconds
+        buckets = self.usage[scope].setdefault(key, deque())
+        if buckets and buckets[-1][0] == bucket_start:
+            buckets[-1][1] += tokens
+        else:
+            buckets.append([bucket_start, tokens])
+        self.totals[scope][key] = self.totals[scope].get(key, 0) + tokens
+
+    def record(self, user_id, guild_id, tokens):
+        now = time.time()
+        self._add("users", user_id, tokens, now)
+        if guild_id is not None:
+            self._add("guilds", guild_id, tokens, now)
+        self.dirty = True
+
+    def used(self, scope, key, now=None):
+        buckets = self.usage[scope].get(key)
+        if not buckets:
+            return 0
+        now = now or time.time()
+        while buckets and buckets[0][0] + self.bucket_seconds <= now - self.window:
+            buckets.popleft()
+        if not buckets:
+            del self.usage[scope][key]
+            return 0
+        return sum(tokens for _, tokens in buckets)
+
+    def _resets_in(self, scope, key, budget, now):
+        # Seconds until enough old buckets expire to bring usage back under budget
+        buckets = self.usage[scope][key]
+        remaining = sum(tokens for _, tokens in buckets)
+        for bucket_start, tokens in buckets:
+            remaining -= tokens
+            if remaining < budget:
+                return max(0, bucket_start + self.bucket_seconds + self.window - now)
+        return self.window
+
+    def check(self, user_id, guild_id):
+        """Return None if the user may make a request, otherwise a message explaining why not."""
+        now = time.time()
+        if self.user_budget and self.used("users", user_id, now) >= self.user_budget:
+            minutes = self._resets_in("users", user_id, self.user_budget, now) / 60
+            return f"You've used your token budget for now. Try again in about {max(1, round(minutes))} minutes."
+        if guild_id is not None and self.guild_budget and self.used("guilds", guild_id, now) >= self.guild_budget:
+            minutes = self._resets_in("guilds", guild_id, self.guild_budget, now) / 60
+            return f"This server has used its token budget for now. Try again in about {max(1, round(minutes))} minutes."
+        return None
+
+    def top(self, scope, n=10):
+        """The n heaviest users or guilds as (id, tokens in window, total tokens)."""
+        now = time.time()
+        rows = [(key, self.used(scope, key, now), self.totals[scope].get(key, 0)) for key in list(self.usage[scope])]
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return [row for row in rows if row[1]][:n]
+
+    def to_dict(self):
+        return {
+            scope: {
+                "window": {str(k): [list(b) for b in v] for k, v in self.usage[scope].items()},
+                "total": {str(k): v for k, v in self.totals[scope].items()},
+            }
+            for scope in ("users", "guilds")
+        }
+
+    def load_dict(self, data):
+        for scope in ("users", "guilds"):
+            section = data.get(scope, {})
+            for key, buckets in section.get("window", {}).items():
+                self.usage[scope][int(key)] = deque([bucket_start, tokens] for bucket_start, tokens in buckets)
+            for key, tokens in section.get("total", {}).items():
+                self.totals[scope][int(key)] = tokens